@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""
+Offline benchmarks of the lookup path: GspreadReader.get_info, options resolution, the /i and /find commands,
+run against a generated worksheet and fakeredis instead of Google Sheets and Redis
+
+Usage:
+    python benchmarks/bench_lookup.py [--rows 1000,10000,100000] [--iterations 2000] [--columns 10]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '../tests'))
+
+from fakes import FakeWorksheet, make_update
+from fakes import make_bot as make_test_bot
+
+SOURCE_URL = 'https://docs.google.com/spreadsheets/d/benchmark'
+
+
+def make_bot(worksheet, options_cache=True):
+    bot = make_test_bot(worksheet, {'index_ttl': 3600})
+    if not options_cache:
+        # Every resolution goes to Redis
+        bot.options.cache.max_size = 0
+
+    return bot
+
+
+async def measure(func, keys, iterations):
+    """Runs func(key) iterations times cycling through keys, returns per call durations in seconds"""
+    durations = []
+    for i in range(iterations):
+        key = keys[i % len(keys)]
+        start = time.perf_counter()
+        await func(key)
+        durations.append(time.perf_counter() - start)
+
+    return durations
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+def report(name, rows, durations):
+    values = sorted(durations)
+    total = sum(values)
+    print(f'{name:<28} {rows:>8} {percentile(values, 50) * 1e6:>10.1f} {percentile(values, 95) * 1e6:>10.1f} '
+          f'{percentile(values, 99) * 1e6:>10.1f} {len(values) / total if total else 0:>12.0f}')
+
+
+async def run(rows, columns, iterations):
+    worksheet = FakeWorksheet(rows, columns)
+    return_columns = ','.join(str(col) for col in range(2, min(columns, 5) + 1))
+    # Spread keys across the sheet and mix in some that are not there
+    keys = [f'K{row:07d}' for row in range(1, rows + 1, max(1, rows // 997))] + ['missing']
+
+    cached_bot = make_bot(worksheet)
+    uncached_bot = make_bot(worksheet, options_cache=False)
+    for bot in (cached_bot, uncached_bot):
+        update, context = make_update(f'/cfg_set_source default {SOURCE_URL} 1 1 {return_columns}')
+        await bot.common_handler(update, context)
+
+    try:
+        # Index build: every call rebuilds the index from the worksheet
+        async def build(key):
+            cached_bot.gspread.indexes.clear()
+            await cached_bot.gspread.get_info(SOURCE_URL, key, 1, return_columns, 1)
+        report('get_info (index build)', rows, await measure(build, keys, max(3, min(iterations, 2_000_000 // rows))))
+
+        async def get_info(key):
+            await cached_bot.gspread.get_info(SOURCE_URL, key, 1, return_columns, 1)
+        report('get_info (cached index)', rows, await measure(get_info, keys, iterations))
+
+        report('options resolve (cached)', rows,
+               await measure(lambda key: cached_bot.get_current_source(1), keys, iterations))
+        report('options resolve (redis)', rows,
+               await measure(lambda key: uncached_bot.get_current_source(1), keys, iterations))
+
+        async def cmd_i(key):
+            update, context = make_update(f'/i {key}')
+            await cached_bot.common_handler(update, context)
+        report('/i one key', rows, await measure(cmd_i, keys, iterations))
+
+        batch = ' '.join(keys[:50])
+
+        async def cmd_i_batch(key):
+            update, context = make_update(f'/i {batch}')
+            await cached_bot.common_handler(update, context)
+        report('/i 50 keys', rows, await measure(cmd_i_batch, keys, max(1, iterations // 10)))
+
+        async def cmd_find(key):
+            update, context = make_update(f'/find {key[:-2].lower()}')
+            await cached_bot.common_handler(update, context)
+        report('/find prefix', rows, await measure(cmd_find, keys, iterations))
+    finally:
+        for bot in (cached_bot, uncached_bot):
+            await bot.options.close()
+            bot.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Lookup path benchmarks',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--rows', default='1000,10000,100000', help='Comma separated worksheet sizes')
+    parser.add_argument('--columns', type=int, default=10, help='Worksheet columns')
+    parser.add_argument('--iterations', type=int, default=2000, help='Calls measured per benchmark')
+    args = parser.parse_args()
+
+    print(f'{"benchmark":<28} {"rows":>8} {"p50 us":>10} {"p95 us":>10} {"p99 us":>10} {"ops/s":>12}')
+    for rows in [int(r) for r in args.rows.split(',') if r]:
+        asyncio.run(run(rows, args.columns, args.iterations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Options class for asyncio code: same options as Options, stored through a pooled asyncio Redis client
+"""
+import asyncio
+import logging
+from .async_redis import AsyncRedis
+from .local_cache import LocalCache
+from .options import Options
+
+
+class AsyncOptions(Options):
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, setup, redis_host='localhost', redis_port=6379, redis_password=None,
+                 redis_max_connections=20, redis_timeout=5, cache_size=1000, cache_ttl=60, redis_client=None):
+        self.redis = AsyncRedis(host=redis_host, port=redis_port, password=redis_password,
+                                max_connections=redis_max_connections, timeout=redis_timeout, client=redis_client)
+        self.cache = LocalCache(cache_size, cache_ttl, name='options')
+        self.valid_options = {}
+        self.load_setup(setup)
+
+    async def get_option(self, user_id, option_name, option_key = None):
+        """ Returns option value """
+        return await self.run(self.get_option_steps(user_id, option_name, option_key))
+
+    async def resolve_option(self, user_id, option_name, dict_option_name):
+        """ Returns (str option value, dict option value under that key) with at most one storage round trip """
+        return await self.run(self.resolve_option_steps(user_id, option_name, dict_option_name))
+
+    async def set_option(self, user_id, option_name, option_value, option_key = None):
+        """ Store option value """
+        return await self.run(self.set_option_steps(user_id, option_name, option_value, option_key))
+
+    async def delete_option(self, user_id, option_name, option_key = None):
+        """ Delete stored option value, so the default is returned again """
+        return await self.run(self.delete_option_steps(user_id, option_name, option_key))
+
+    async def get_option_items(self, user_id, option_name):
+        """ Returns all {key: value} pairs of a dict option """
+        return await self.run(self.get_option_items_steps(user_id, option_name))
+
+    async def migrate_dict_options(self):
+        """ One-shot migration of dict options stored as JSON documents to hashes, keys already converted are skipped """
+        return await self.run(self.migrate_dict_options_steps())
+
+    async def run(self, steps):
+        """ Runs an operation of Options, its storage calls are awaited and the replies sent back to it """
+        reply = None
+        try:
+            while True:
+                reply = await steps.send(reply)
+        except StopIteration as stop:
+            return stop.value
+
+    async def listen_invalidations(self):
+        """ Drops cached options changed by other processes, runs until cancelled """
+        while True:
+            try:
+                async for storage_key in self.redis.listen(self.invalidation_channel):
+                    self.invalidate(storage_key)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.warning('Options invalidation listener: %s', e)
+
+            # Invalidations may have been missed while disconnected, cache TTL bounds staleness until resubscribed
+            self.invalidate()
+            await asyncio.sleep(1)
+
+    async def close(self):
+        """Close Redis connections"""
+        if hasattr(self, 'redis'):
+            await self.redis.close()
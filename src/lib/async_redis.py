@@ -0,0 +1,152 @@
+"""
+Asyncio Redis client class for storing and retrieving data without blocking the event loop
+"""
+import redis
+import redis.asyncio
+import time
+from redis.asyncio.retry import Retry
+from redis.backoff import ExponentialBackoff
+from typing import Any, AsyncIterator
+from . import metrics
+from .redis import Redis
+
+
+class InstrumentedClient(redis.asyncio.Redis):
+    """redis-py asyncio client that records every round trip duration by command"""
+
+    async def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            metrics.REDIS_COMMAND_DURATION.labels(args[0]).observe(time.perf_counter() - start)
+
+
+class AsyncRedis(Redis):
+    """
+    Redis client for the event loop. Commands, their arguments and reply conversions are inherited
+    from Redis and return awaitables, only waiting for replies, iteration and connection handling live here
+    """
+
+    def __init__(self, host: str = 'localhost', port: int = 6379, db: int = 0, password: str = None,
+                 max_connections: int = 20, timeout: float = 5, retries: int = 3, client=None):
+        """
+        Initialize Redis connection pool, connections are opened on first use
+        
+        Args:
+            host: Redis server host
+            port: Redis server port
+            db: Redis database number
+            password: Redis password (optional)
+            max_connections: Pool size, callers wait for a free connection when all are busy
+            timeout: Seconds to wait for connect, reply or a free pool connection
+            retries: Attempts to repeat a command after connection loss or timeout
+            client: Ready redis.asyncio.Redis compatible client to use instead of the pool, e.g. fakeredis
+        """
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        if client is not None:
+            self.pool = None
+            self.client = client
+        else:
+            self.pool = redis.asyncio.BlockingConnectionPool(
+                host=host,
+                port=port,
+                db=db,
+                password=password,
+                decode_responses=True,
+                max_connections=max_connections,
+                timeout=timeout,
+                socket_timeout=timeout,
+                socket_connect_timeout=timeout,
+                retry=Retry(ExponentialBackoff(cap=1, base=0.05), retries),
+                retry_on_error=[redis.ConnectionError, redis.TimeoutError],
+                health_check_interval=30
+            )
+            self.client = InstrumentedClient(connection_pool=self.pool)
+        self.binary_client = None
+        self.register_scripts()
+    
+    async def execute(self, error: str, convert, func, *args, **kwargs) -> Any:
+        """Awaiting version of Redis.execute, the rest of a command is shared with the synchronous client"""
+        try:
+            reply = await func(*args, **kwargs)
+        except redis.RedisError as e:
+            raise Exception(f"{error}: {e}")
+        
+        return reply if convert is None else convert(reply)
+    
+    async def hscan(self, key: str, count: int = 100) -> AsyncIterator[tuple]:
+        """
+        Iterate hash fields in batches without blocking the server on big hashes
+        
+        Args:
+            key: Redis key of the hash
+            count: Fields fetched per round trip
+        
+        Returns:
+            Iterator of (field, value) tuples
+        """
+        try:
+            async for item in self.client.hscan_iter(key, count=count):
+                yield item
+        except redis.RedisError as e:
+            raise Exception(f"Failed to scan hash in Redis: {e}")
+    
+    async def get_hash(self, key: str, count: int = 100) -> dict:
+        """
+        Get all fields of a hash, read in batches like hscan
+        
+        Args:
+            key: Redis key of the hash
+            count: Fields fetched per round trip
+        
+        Returns:
+            Dictionary of field values
+        """
+        return {field: value async for field, value in self.hscan(key, count)}
+    
+    async def scan_keys(self, match: str, count: int = 100) -> list:
+        """
+        Find keys by glob pattern without blocking the server
+        
+        Args:
+            match: Key pattern, e.g. 'sources:*'
+            count: Keys checked per round trip
+        
+        Returns:
+            List of matching keys
+        """
+        try:
+            return [key async for key in self.client.scan_iter(match=match, count=count)]
+        except redis.RedisError as e:
+            raise Exception(f"Failed to scan keys in Redis: {e}")
+    
+    async def listen(self, channel: str) -> AsyncIterator[str]:
+        """
+        Subscribe to a pub/sub channel and yield its messages, holds one pool connection while iterated
+        
+        Args:
+            channel: Channel name
+        
+        Returns:
+            Async iterator of message texts, raises when the connection is lost
+        """
+        pubsub = self.client.pubsub()
+        try:
+            await pubsub.subscribe(channel)
+            async for message in pubsub.listen():
+                if message['type'] == 'message':
+                    yield message['data']
+        except redis.RedisError as e:
+            raise Exception(f"Lost Redis subscription to {channel}: {e}")
+        finally:
+            await pubsub.aclose()
+    
+    async def close(self):
+        """Close all pool connections"""
+        await self.client.aclose()
+        if self.pool is not None:
+            await self.pool.disconnect()
@@ -0,0 +1,171 @@
+"""
+Offset index of a local CSV/TSV file: only the seek column values are kept in memory, each mapped to the byte offset
+of its record. A lookup reads and parses just the matching record, so exports of any size are served without
+loading them.
+
+Records are read with os.pread on a descriptor held open, not through a memory mapping: a file rewritten or truncated
+in place then gives a short read, while reading a mapping past the new end of file kills the process with SIGBUS.
+"""
+import csv
+import os
+import sys
+import time
+from .sheet_index import SheetIndex, VERSIONS
+
+BOM = b'\xef\xbb\xbf'
+
+
+class CsvIndex(SheetIndex):
+    path = None
+    delimiter = ','
+    encoding = 'utf-8'
+    # Descriptor the records are read through, a file replaced by rename keeps being read from its old version
+    fd = None
+    # Bytes read at once when looking for the end of a record
+    chunk_size = 4096
+    # (modification time in ns, size) of the file the index was built from
+    marker = None
+    # Monotonic time the file was last checked for changes
+    checked_at = 0.0
+    # Rows are byte offsets of records, over 4 GB they do not fit 32 bits
+    row_typecode = 'Q'
+
+    def __init__(self, path, seek, delimiter=',', encoding='utf-8'):
+        """Index records of the file by the seek column (blocking, reads the whole file once).
+
+        Args:
+            path: path of the file, the first record is the header
+            seek: 1-based column index to index records by, or a tuple of them for a composite key
+            delimiter: field delimiter, ',' for CSV and '\t' for TSV
+            encoding: text encoding of the file
+        """
+        self.path = path
+        self.seek = seek
+        self.delimiter = delimiter
+        self.encoding = encoding
+        self.version = next(VERSIONS)
+        self.last_row = None
+        self.last_fields = []
+
+        self.fd = os.open(path, os.O_RDONLY)
+        stat = os.fstat(self.fd)
+        self.marker = (stat.st_mtime_ns, stat.st_size)
+
+        records = self.records()
+        header = next(records, None)
+        self.headers = dict(enumerate(header[1], 1)) if header else {}
+
+        seek_columns = seek if isinstance(seek, tuple) else (seek,)
+        keys = []
+        offsets = []
+        for offset, fields in records:
+            key = tuple(fields[col - 1] if col <= len(fields) else '' for col in seek_columns)
+            keys.append(key if isinstance(seek, tuple) else key[0])
+            offsets.append(offset)
+
+        # Filled bottom up, so the first matching record wins, same as a top-down scan
+        self.rows = dict(zip(reversed(keys), reversed(offsets)))
+
+        self.built_at = self.checked_at = time.monotonic()
+
+    def records(self):
+        """Yields (byte offset, fields) of the records in file order, blank lines are skipped"""
+        # Read sequentially through its own descriptor, the one held open is only used with pread
+        with os.fdopen(os.dup(self.fd), 'rb') as f:
+            start = offset = 0
+            record = b''
+            for line in f:
+                offset += len(line)
+                record = record + line if record else line
+                # A quoted field may hold line breaks: the record goes on until its quotes are balanced
+                if b'"' in record and record.count(b'"') % 2:
+                    continue
+
+                fields = self.parse(record[len(BOM):] if start == 0 and record.startswith(BOM) else record)
+                if fields:
+                    yield start, fields
+                start = offset
+                record = b''
+
+            if record:
+                fields = self.parse(record)
+                if fields:
+                    yield start, fields
+
+    def read_record(self, offset):
+        """Read and parse the record starting at the byte offset.
+
+        Returns:
+            (list of field strings, byte offset of the next record)
+        """
+        line = b''
+        while True:
+            chunk = os.pread(self.fd, self.chunk_size, offset + len(line))
+            newline = chunk.find(b'\n')
+            if newline < 0:
+                line += chunk
+                if len(chunk) < self.chunk_size:
+                    # End of file
+                    break
+                continue
+
+            line += chunk[:newline]
+            if line.count(b'"') % 2 == 0:
+                break
+            line += b'\n'
+
+        if not line and offset > 0:
+            # The file got shorter than the index: next lookup checks the file and indexes it again
+            self.checked_at = 0.0
+            raise Exception('Файл источника изменился, повторите запрос')
+
+        return self.parse(line), offset + len(line) + 1
+
+    def parse(self, record):
+        """Returns fields of the record bytes, [] for a blank line"""
+        text = record.decode(self.encoding, errors='replace').rstrip('\r\n')
+        if not text:
+            return []
+        if '"' not in text:
+            return text.split(self.delimiter)
+
+        return next(csv.reader([text], delimiter=self.delimiter), [])
+
+    def get_value(self, row, col):
+        """Returns cell value of the record at the byte offset in the 1-based column, '' for empty cells"""
+        # Columns of one row are read one after another, the record is parsed once
+        if row != self.last_row:
+            self.last_fields = self.read_record(row)[0]
+            self.last_row = row
+
+        return self.last_fields[col - 1] if col <= len(self.last_fields) else ''
+
+    def is_modified(self):
+        """Checks if the file was changed, replaced or removed since the index was built"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return True
+
+        return (stat.st_mtime_ns, stat.st_size) != self.marker
+
+    def close(self):
+        """Close the file descriptor"""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __del__(self):
+        self.close()
+
+    def memory_size(self):
+        """Returns estimated memory footprint in bytes: the key map and the search index, cells stay in the file"""
+        if self.size is None:
+            keys = list(self.rows)
+            size = sys.getsizeof(self.rows) + self.objects_size(keys) + self.objects_size(list(self.rows.values()))
+            if self.search_keys is not None:
+                size += sys.getsizeof(self.search_keys) + sys.getsizeof(self.search_rows)
+                size += self.objects_size(self.search_keys)
+            self.size = int(size)
+
+        return self.size
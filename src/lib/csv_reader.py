@@ -0,0 +1,118 @@
+"""
+Local file Datasource: serves CSV/TSV exports from the data directory, addressed as file:///path/export.csv
+or relative to the data directory as file:export.csv
+"""
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote, urlsplit
+from . import metrics
+from .csv_index import CsvIndex
+from .data_source import DataSource
+from .quota_scheduler import INTERACTIVE
+from .snapshot_store import SnapshotStore
+
+DELIMITERS = {'.tsv': '\t', '.tab': '\t'}
+
+
+class CsvReader(DataSource):
+    schemes = ('file',)
+    data_dir = None
+    # Seconds between checks of the file for changes, unless the source sets its own ttl
+    check_interval = 10
+    loading = {}
+
+    def __init__(self, config, indexes=None):
+        """
+        Args:
+            config: bot config, file sources are served only from data_dir
+            indexes: SnapshotStore shared with other backends, so all sources stay within one memory budget
+        """
+        self.data_dir = os.path.realpath(config['data_dir']) if config.get('data_dir') else None
+        self.indexes = indexes
+        if indexes is None:
+            self.indexes = SnapshotStore(float(config.get('snapshot_memory_mb') or 256) * 1024 * 1024)
+        self.loading = {}
+        self.logger = logging.getLogger(__name__)
+
+        # Indexing reads the whole file once, it runs off the event loop
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='csv')
+
+    def parse_location(self, location):
+        """Returns (path inside the data directory, field delimiter) of a file:// source URL"""
+        if not self.data_dir:
+            raise Exception('Файловые источники отключены: не задан каталог данных (DATA_DIR)')
+
+        url = urlsplit(str(location))
+        path = os.path.realpath(os.path.join(self.data_dir, unquote(url.path)))
+        # Sources are configured from the chat, they must not reach files outside the data directory
+        if os.path.commonpath([self.data_dir, path]) != self.data_dir:
+            raise Exception('Файл источника должен находиться в каталоге данных')
+
+        delimiter = parse_qs(url.query).get('delimiter', [None])[0]
+        if delimiter is None:
+            delimiter = DELIMITERS.get(os.path.splitext(path)[1].lower(), ',')
+        elif delimiter == 'tab':
+            delimiter = '\t'
+        if len(delimiter) != 1:
+            raise Exception('Разделитель колонок должен быть одним символом')
+
+        return path, delimiter
+
+    def check_location(self, location):
+        """Validate the source URL when the source is configured"""
+        path, _ = self.parse_location(location)
+        if not os.path.isfile(path):
+            raise Exception(f'Файл источника не найден: {location}')
+
+    async def get_index(self, location, sheet, seek, columns, ttl = None, priority = INTERACTIVE):
+        """Return offset index of the file, rebuilt once the file changes.
+
+        The sheet is ignored, a file has one. All columns of the file are available, whatever columns are requested.
+        """
+        path, delimiter = self.parse_location(location)
+        index_key = (path, delimiter, seek)
+
+        index = self.indexes.get(index_key)
+        if index is not None:
+            index.used_at = time.monotonic()
+            if time.monotonic() - index.checked_at < (self.check_interval if ttl is None else float(ttl)):
+                metrics.CACHE_REQUESTS.labels('file_index', 'hit').inc()
+                return index
+
+            # Offsets of the old index point into different records of a changed file, so it is indexed again first
+            if not index.is_modified():
+                index.checked_at = time.monotonic()
+                metrics.CACHE_REQUESTS.labels('file_index', 'hit').inc()
+                return index
+
+        if not os.path.isfile(path):
+            raise Exception(f'Файл источника не найден: {location}')
+
+        # Single flight: concurrent callers share the indexing already in progress for this file
+        task = self.loading.get(index_key)
+        if task is None:
+            metrics.CACHE_REQUESTS.labels('file_index', 'miss').inc()
+            task = asyncio.ensure_future(self.load_index(index_key, path, seek, delimiter))
+            self.loading[index_key] = task
+        else:
+            metrics.CACHE_REQUESTS.labels('file_index', 'coalesced').inc()
+
+        index = await asyncio.shield(task)
+        index.used_at = time.monotonic()
+
+        return index
+
+    async def load_index(self, index_key, path, seek, delimiter):
+        """Index the file on the worker pool and put the index into the store"""
+        try:
+            start = time.monotonic()
+            index = await self.run_blocking(CsvIndex, path, seek, delimiter)
+            self.indexes.set(index_key, index)
+            self.logger.info('Indexed %s: %d records in %.1f s', path, len(index), time.monotonic() - start)
+
+            return index
+        finally:
+            self.loading.pop(index_key, None)
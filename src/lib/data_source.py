@@ -0,0 +1,278 @@
+"""
+Data source interface: a backend turns a source URL into a snapshot of seek column index and requested columns,
+lookups of all backends share the code below. DataSourceRouter picks the backend by the URL scheme.
+"""
+import asyncio
+import functools
+import time
+from urllib.parse import urlsplit
+from . import metrics
+from .quota_scheduler import BACKGROUND, INTERACTIVE
+from .sheet_index import SheetIndex
+
+
+class DataSource:
+    # URL schemes served by the backend
+    schemes = ()
+    indexes = None
+    index_ttl = 300
+    executor = None
+
+    async def get_index(self, location, sheet, seek, columns, ttl = None, priority = INTERACTIVE):
+        """Return index of the source: a SheetIndex, or an object with the same lookup methods.
+
+        Args:
+            location: source URL
+            sheet: 1-based worksheet index
+            seek: 1-based column index to search for the key or tuple of them for a composite key
+            columns: list of 1-based column indexes to return
+            ttl: seconds the snapshot stays fresh, None for index_ttl
+            priority: quota_scheduler.INTERACTIVE or BACKGROUND, for backends with a request quota
+
+        Returns:
+            SheetIndex
+        """
+        raise NotImplementedError
+
+    def check_location(self, location):
+        """Validate the source URL when the source is configured, raises on URLs the backend cannot serve"""
+
+    async def get_info(self, location, key, seek, columns, sheet = 1, ttl = None):
+        """Find row by key in seek column and return requested columns.
+
+        Args:
+            location: source URL
+            key: value to search in seek column, tuple of values for several seek columns
+            seek: 1-based column index to search for the key, several comma separated for a composite key
+            columns: list of 1-based column indexes to return
+            sheet: 1-based worksheet index (default: 1)
+            ttl: seconds the worksheet snapshot stays fresh, None for index_ttl
+
+        Returns:
+            dict of {header: value} for requested columns if found, otherwise {}
+        """
+        if key is None:
+            raise Exception('Требуется значение ключа')
+
+        return (await self.get_info_many(location, [key], seek, columns, sheet, ttl))[0]
+
+    async def get_info_many(self, location, keys, seek, columns, sheet = 1, ttl = None, snapshot = None):
+        """Find rows for several keys against one snapshot of the worksheet.
+
+        Args:
+            location: source URL
+            keys: list of values to search in seek column, tuples of values for several seek columns
+            seek: 1-based column index to search for the keys, several comma separated for a composite key
+            columns: list of 1-based column indexes to return
+            sheet: 1-based worksheet index (default: 1)
+            ttl: seconds the worksheet snapshot stays fresh, None for index_ttl
+            snapshot: SheetIndex from get_snapshot to search, None for the current one
+
+        Returns:
+            list of {header: value} dicts in the order of keys, {} for keys that are not found
+        """
+        # Basic input validation
+        if not location:
+            raise Exception('Требуется адрес источника')
+        if not keys or any(key is None for key in keys):
+            raise Exception('Требуется значение ключа')
+        seek_col_index, requested_columns = self.parse_columns(seek, columns)
+        if isinstance(seek_col_index, tuple) and any(not isinstance(key, tuple) or len(key) != len(seek_col_index)
+                                                     for key in keys):
+            raise Exception(f'Ключ должен состоять из {len(seek_col_index)} значений')
+
+        index = snapshot
+        if index is None:
+            index = await self.get_index(location, sheet, seek_col_index, requested_columns, ttl)
+        headers = self.get_headers(index, requested_columns)
+
+        start = time.perf_counter()
+        target_rows = [index.lookup(key) for key in keys]
+        if None in target_rows:
+            # Keys typed with different case, spacing or leading zeros are matched by their normalized form
+            if index.search_keys is None:
+                await self.build_search_index(index)
+            target_rows = [index.lookup_normalized(key) if row is None else row for key, row in zip(keys, target_rows)]
+
+        results = [self.get_row_info(index, row, headers) for row in target_rows]
+        metrics.INDEX_LOOKUP_DURATION.observe(time.perf_counter() - start)
+
+        return results
+
+    async def find(self, location, prefix, seek, columns, sheet = 1, limit = 10, ttl = None):
+        """Find rows whose seek column value starts with prefix, compared in normalized form.
+
+        Args:
+            location: source URL
+            prefix: beginning of the value in seek column, tuple of leading values for several seek columns
+            seek: 1-based column index to search in, several comma separated for a composite key
+            columns: list of 1-based column indexes to return
+            sheet: 1-based worksheet index (default: 1)
+            limit: max number of rows to return
+            ttl: seconds the worksheet snapshot stays fresh, None for index_ttl
+
+        Returns:
+            list of (seek column value, {header: value}) tuples ordered by normalized value
+        """
+        if not location:
+            raise Exception('Требуется адрес источника')
+        if prefix is None or SheetIndex.normalize_key(prefix).strip('\0') == '':
+            raise Exception('Требуется начало ключа')
+        seek_col_index, requested_columns = self.parse_columns(seek, columns)
+
+        index = await self.get_index(location, sheet, seek_col_index, requested_columns, ttl)
+        headers = self.get_headers(index, requested_columns)
+        if index.search_keys is None:
+            await self.build_search_index(index)
+
+        return [(index.get_key(row), self.get_row_info(index, row, headers)) for row in index.search(prefix, limit)]
+
+    async def get_snapshot(self, location, seek, columns, sheet = 1, ttl = None, priority = INTERACTIVE):
+        """Returns current SheetIndex of the worksheet, loading it if needed.
+
+        Its version identifies the data: anything derived from a lookup stays valid while the version is the same.
+        Loads for nobody waiting on them, like preloading, go with BACKGROUND priority.
+        """
+        if not location:
+            raise Exception('Требуется адрес источника')
+        seek_col_index, requested_columns = self.parse_columns(seek, columns)
+
+        return await self.get_index(location, sheet, seek_col_index, requested_columns, ttl, priority)
+
+    async def preload(self, location, seek, columns, sheet = 1, ttl = None):
+        """Open the source and build its index ahead of the first lookup, with background priority.
+
+        Returns:
+            number of indexed rows
+        """
+        return len(await self.get_snapshot(location, seek, columns, sheet, ttl, BACKGROUND))
+
+    async def build_search_index(self, index):
+        """Build sorted search index of the snapshot on the worker pool, it counts towards the memory budget"""
+        await self.run_blocking(index.build_search_index)
+        self.forget_indexes(self.indexes.evict())
+
+    @staticmethod
+    def parse_columns(seek, columns):
+        """Validate seek columns and requested columns.
+
+        Returns:
+            (1-based seek column index or tuple of them for a composite key, list of 1-based requested column indexes)
+        """
+        if isinstance(seek, str):
+            seek = [c for c in seek.split(',') if c.strip() != '']
+        elif not isinstance(seek, (list, tuple)):
+            seek = [seek]
+        try:
+            seek_columns = tuple(int(str(c).strip()) for c in seek)
+        except Exception:
+            raise Exception('Некорректный номер колонки для поиска (seek)')
+        if not seek_columns or not all(c > 0 for c in seek_columns):
+            raise Exception('Номер колонки для поиска должен быть положительным числом')
+        if len(set(seek_columns)) != len(seek_columns):
+            raise Exception('Колонки для поиска не должны повторяться')
+        seek_col_index = seek_columns[0] if len(seek_columns) == 1 else seek_columns
+
+        if isinstance(columns, str):
+            columns = [c for c in columns.split(',') if c != '']
+        try:
+            requested_columns = [int(str(c).strip()) for c in columns]
+        except Exception:
+            raise Exception('Некорректный список колонок')
+        if not requested_columns:
+            raise Exception('Список колонок не должен быть пустым')
+        if not all(c > 0 for c in requested_columns):
+            raise Exception('Номера колонок должны быть положительными числами')
+
+        return seek_col_index, requested_columns
+
+    @staticmethod
+    def get_headers(index, requested_columns):
+        """Returns {column: display header} for the requested columns"""
+        headers = {}
+        for col in requested_columns:
+            header = index.get_header(col)
+            headers[col] = str.capitalize(header) if header != '' else f"Column {col}"
+
+        return headers
+
+    @staticmethod
+    def get_row_info(index, row, headers):
+        """Returns {header: value} of the data row, {} if the row is None"""
+        if row is None:
+            return {}
+
+        return {header: index.get_value(row, col) for col, header in headers.items()}
+
+    async def run_blocking(self, func, *args):
+        """Run blocking call on the worker pool of the backend and await its result"""
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args))
+
+
+    def forget_indexes(self, index_keys):
+        """Called with keys of indexes evicted from the memory budget"""
+
+    async def refresh_loop(self, interval=30):
+        """Background refresh of indexes, backends without one return at once"""
+
+    def close(self):
+        """Stop worker pool"""
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class DataSourceRouter(DataSource):
+    """Serves every source URL by the backend registered for its scheme"""
+    backends = {}
+    default = None
+
+    def __init__(self, backends):
+        """
+        Args:
+            backends: list of DataSource, the first one registered for a scheme wins, the first of all
+                      also serves URLs without a scheme, as sources did before there were several backends
+        """
+        self.backends = {}
+        for backend in backends:
+            for scheme in backend.schemes:
+                self.backends.setdefault(scheme, backend)
+        self.default = backends[0]
+
+    def get_backend(self, location):
+        """Returns backend of the source URL"""
+        if not location:
+            raise Exception('Требуется адрес источника')
+
+        scheme = urlsplit(str(location)).scheme.lower()
+        backend = self.backends.get(scheme) if scheme else self.default
+        if backend is None:
+            raise Exception(f'Неподдерживаемый адрес источника: {location}. '
+                            f'Поддерживаются: {", ".join(s + "://" for s in sorted(self.backends))}')
+
+        return backend
+
+    def check_location(self, location):
+        self.get_backend(location).check_location(location)
+
+    async def get_index(self, location, sheet, seek, columns, ttl = None, priority = INTERACTIVE):
+        return await self.get_backend(location).get_index(location, sheet, seek, columns, ttl, priority)
+
+    async def get_info_many(self, location, keys, seek, columns, sheet = 1, ttl = None, snapshot = None):
+        return await self.get_backend(location).get_info_many(location, keys, seek, columns, sheet, ttl, snapshot)
+
+    async def find(self, location, prefix, seek, columns, sheet = 1, limit = 10, ttl = None):
+        return await self.get_backend(location).find(location, prefix, seek, columns, sheet, limit, ttl)
+
+    async def get_snapshot(self, location, seek, columns, sheet = 1, ttl = None, priority = INTERACTIVE):
+        return await self.get_backend(location).get_snapshot(location, seek, columns, sheet, ttl, priority)
+
+    async def refresh_loop(self, interval=30):
+        """Runs refresh loops of all backends until cancelled"""
+        await asyncio.gather(*(backend.refresh_loop(interval) for backend in set(self.backends.values())))
+
+    def close(self):
+        """Close all backends"""
+        for backend in set(self.backends.values()):
+            backend.close()
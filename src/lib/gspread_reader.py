@@ -1,106 +1,397 @@
+import asyncio
+import functools
 import gspread
+import logging
 import re
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from . import metrics
+from .data_source import DataSource
+from .quota_scheduler import BACKGROUND, INTERACTIVE, QuotaScheduler
+from .sheet_index import SheetIndex
+from .snapshot_store import SnapshotStore
 
 """
 Google Spreadsheets Datasource: returns given columns from google spreadsheets if the row with given key is found
 """
 
-class GspreadReader:
+class GspreadReader(DataSource):
+    schemes = ('https', 'http')
     reader = None
     config = {}
     sources = {}
+    indexes = None
+    index_ttl = 300
+    index_max_age = 3600
+    # index key -> (location, sheet, seek, columns, ttl) to reload the index with
+    index_sources = {}
+    executor = None
+    loading = {}
+    # index key -> priority of the load in flight, raised when an interactive lookup joins a background load
+    load_priorities = {}
+    coalesced_calls = 0
+    workers = 4
+    # Workers background loads may hold at once, the rest are kept for lookups
+    background_workers = 2
+    # priority -> loads holding a worker
+    busy_workers = {}
+    # (index key, future) of loads waiting for a worker
+    load_queue = []
+    snapshot_cache = None
+    disk_store = None
+    quota = None
 
-    def __init__(self, config):
+    def __init__(self, config, snapshot_cache=None, client=None, disk_store=None):
+        """
+        Args:
+            config: bot config, gsa_file is required unless client is given
+            snapshot_cache: optional lib.snapshot_cache.SnapshotCache shared with other bot replicas
+            client: ready gspread.Client compatible object, e.g. a local stand-in for benchmarks
+            disk_store: optional lib.snapshot_disk.DiskSnapshotStore that keeps snapshots across restarts
+        """
         if config:
             self.config = config
 
-        if 'gsa_file' not in config:
-            raise Exception('Не указан путь к файлу сервисного аккаунта Google для gspread')
-        elif not os.path.exists(config['gsa_file']):
-            raise Exception(f"Файл сервисного аккаунта Google не найден: {config['gsa_file']}")
+        self.snapshot_cache = snapshot_cache
+        self.disk_store = disk_store
+        # Per instance, readers of different clients must not share worksheet handles or indexes
+        self.sources = {}
+        self.indexes = SnapshotStore(float(config.get('snapshot_memory_mb') or 256) * 1024 * 1024)
+        self.index_sources = {}
+        self.loading = {}
+        self.load_priorities = {}
+        self.busy_workers = {INTERACTIVE: 0, BACKGROUND: 0}
+        self.load_queue = []
+        self.logger = logging.getLogger(__name__)
+
+        if client is None:
+            if 'gsa_file' not in config:
+                raise Exception('Не указан путь к файлу сервисного аккаунта Google для gspread')
+            elif not os.path.exists(config['gsa_file']):
+                raise Exception(f"Файл сервисного аккаунта Google не найден: {config['gsa_file']}")
+
+        if config.get('index_ttl') is not None:
+            self.index_ttl = int(config['index_ttl'])
+        if config.get('index_max_age') is not None:
+            self.index_max_age = int(config['index_max_age'])
 
-        self.reader = gspread.service_account(filename=config['gsa_file'])
+        # gspread is synchronous: its HTTP calls run on a bounded pool so they never block the event loop
+        self.workers = int(config.get('gspread_workers') or 4)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='gspread')
+        # Loads get workers on the event loop side, interactive ones first: a load queued inside the pool would
+        # wait behind every background load, however urgent. Background loads never take the whole pool.
+        self.background_workers = max(1, min(int(config.get('gspread_background_workers') or self.workers // 2),
+                                             self.workers - 1))
 
-    async def get_info(self, location, key, seek, columns, sheet = 1):
-        """Find row by key in seek column and return requested columns.
+        # All Google calls of this process share the read quota, interactive lookups are served first
+        self.quota = QuotaScheduler(requests_per_minute=float(config.get('google_reads_per_minute') or 0),
+                                    burst=int(config.get('google_burst') or 10),
+                                    max_retries=int(config.get('google_max_retries') or 5))
+
+        self.reader = client if client is not None else gspread.service_account(filename=config['gsa_file'])
+
+    async def get_index(self, location, sheet, seek, columns, ttl = None, priority = INTERACTIVE):
+        """Return seek column index for the worksheet.
+
+        A fresh index is returned as is. A stale one, older than ttl but younger than index_max_age, is returned
+        at once while a new one loads in the background. Without an index, or past index_max_age, callers wait.
 
         Args:
             location: Google Spreadsheet URL
-            key: value to search in seek column
-            seek: 1-based column index to search for the key
-            columns: list of 1-based column indexes to return
-            sheet: 1-based worksheet index (default: 1)
+            sheet: 1-based worksheet index
+            seek: 1-based column index to search for the key or tuple of them for a composite key
+            columns: list of 1-based column indexes to keep in the snapshot
+            ttl: seconds the snapshot stays fresh, None for index_ttl
+            priority: quota_scheduler.INTERACTIVE or BACKGROUND priority of Google calls if the caller has to wait
 
         Returns:
-            dict of {header: value} for requested columns if found, otherwise {}
+            SheetIndex
         """
-        # Normalize types
-        # Basic input validation
-        if not location:
-            raise Exception('Требуется URL таблицы Google')
-        if key is None:
-            raise Exception('Требуется значение ключа')
+        ttl = self.index_ttl if ttl is None else float(ttl)
+        seek_columns = seek if isinstance(seek, tuple) else (seek,)
+        fetch_columns = sorted(set(columns) | set(seek_columns))
+        index_key = (f"{location}::sheet:{sheet}::seek:{','.join(map(str, seek_columns))}"
+                     f"::columns:{','.join(map(str, fetch_columns))}")
+        self.index_sources[index_key] = (location, sheet, seek, fetch_columns, ttl)
+
+        index = self.indexes.get(index_key)
+        if index is not None:
+            index.used_at = time.monotonic()
+            if not index.is_expired(ttl):
+                metrics.CACHE_REQUESTS.labels('index', 'hit').inc()
+                return index
+
+            if not index.is_expired(max(ttl, self.index_max_age)):
+                metrics.CACHE_REQUESTS.labels('index', 'stale').inc()
+                self.refresh_index(index_key, BACKGROUND)
+                return index
+
+        # Single flight: concurrent callers share the load already in progress for this worksheet
+        if index_key in self.loading:
+            metrics.CACHE_REQUESTS.labels('index', 'coalesced').inc()
+            self.coalesced_calls += 1
+        else:
+            metrics.CACHE_REQUESTS.labels('index', 'miss').inc()
+
+        # Shielded so one cancelled caller does not abort the load for everybody else
+        index = await asyncio.shield(self.refresh_index(index_key, priority))
+        index.used_at = time.monotonic()
+        if index.restored and index.is_expired(ttl):
+            # Restored from disk: served right away and checked against the spreadsheet in the background.
+            # A stale snapshot from the shared cache is not: another replica is refreshing it already.
+            index.restored = False
+            self.refresh_index(index_key, BACKGROUND)
+
+        return index
+
+    def refresh_index(self, index_key, priority = BACKGROUND):
+        """Start loading the index unless it is already loading.
+
+        Args:
+            index_key: key of the index in index_sources
+            priority: priority of the Google calls, joining a load with more urgent priority raises it
+
+        Returns:
+            asyncio.Task of the load
+        """
+        self.load_priorities[index_key] = min(priority, self.load_priorities.get(index_key, priority))
+        task = self.loading.get(index_key)
+        if task is None:
+            location, sheet, seek, columns, ttl = self.index_sources[index_key]
+            task = asyncio.ensure_future(self.load_index(index_key, location, sheet, seek, columns, ttl))
+            task.add_done_callback(self.log_load_error)
+            self.loading[index_key] = task
+        else:
+            # A queued load may have just become interactive
+            self.dispatch_loads()
+
+        return task
+
+    async def acquire_worker(self, index_key):
+        """Wait until the load may run on the worker pool: interactive loads take any free worker,
+        background ones only up to background_workers.
+
+        Returns:
+            priority the worker is held with, to be given back to release_worker
+        """
+        waiter = (index_key, asyncio.get_running_loop().create_future())
+        self.load_queue.append(waiter)
+        self.dispatch_loads()
         try:
-            seek_col_index = int(str(seek).strip())
-        except Exception:
-            raise Exception('Некорректный номер колонки для поиска (seek)')
-        if seek_col_index <= 0:
-            raise Exception('Номер колонки для поиска должен быть положительным числом')
-
-        if isinstance(columns, str):
-            columns = [c for c in columns.split(',') if c != '']
+            return await waiter[1]
+        except asyncio.CancelledError:
+            if waiter[1].done() and not waiter[1].cancelled():
+                self.release_worker(waiter[1].result())
+            raise
+        finally:
+            if waiter in self.load_queue:
+                self.load_queue.remove(waiter)
+
+    def release_worker(self, priority):
+        """Give the worker back and pass it on to a waiting load"""
+        self.busy_workers[priority] -= 1
+        self.dispatch_loads()
+
+    def dispatch_loads(self):
+        """Hand free workers to waiting loads, interactive ones first, in order of arrival within a priority"""
+        for waiter in sorted(self.load_queue, key=lambda waiter: self.load_priorities.get(waiter[0], INTERACTIVE)):
+            index_key, future = waiter
+            priority = self.load_priorities.get(index_key, INTERACTIVE)
+            if sum(self.busy_workers.values()) >= self.workers:
+                break
+            if priority != INTERACTIVE and self.busy_workers[priority] >= self.background_workers:
+                # Only background loads are left in the queue
+                break
+
+            self.load_queue.remove(waiter)
+            if not future.done():
+                self.busy_workers[priority] += 1
+                future.set_result(priority)
+
+    def log_load_error(self, task):
+        """Report loads that fail in the background, the stale index keeps being served meanwhile"""
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.warning('Worksheet index refresh failed: %s', task.exception())
+
+    async def load_index(self, index_key, location, sheet, seek, columns, ttl):
+        """Build index on the worker pool and put it into the cache, an index not in memory is looked up on disk first"""
+        try:
+            worker = await self.acquire_worker(index_key)
+            try:
+                current = self.indexes.get(index_key)
+                if current is None and self.disk_store is not None:
+                    index = await self.run_blocking(self.restore_index, index_key, seek, ttl)
+                    if index is not None:
+                        self.forget_indexes(self.indexes.set(index_key, index))
+                        return index
+
+                index = await self.run_blocking(self.build_index, location, sheet, seek, columns,
+                                                functools.partial(self.load_priorities.get, index_key, INTERACTIVE),
+                                                index_key, current, ttl)
+            finally:
+                self.release_worker(worker)
+
+            if index is current:
+                # The spreadsheet has not changed: same data and version, fresh again
+                metrics.CACHE_REQUESTS.labels('index', 'unchanged').inc()
+                index.built_at = time.monotonic()
+            self.forget_indexes(self.indexes.set(index_key, index))
+
+            return index
+        finally:
+            self.loading.pop(index_key, None)
+            self.load_priorities.pop(index_key, None)
+
+    def forget_indexes(self, index_keys):
+        """Stop refreshing evicted indexes, the next lookup loads them again"""
+        for index_key in index_keys:
+            self.index_sources.pop(index_key, None)
+
+    async def refresh_loop(self, interval=30):
+        """Refresh scheduler, runs until cancelled.
+
+        Indexes used since their last load are reloaded in the background once they go stale, so lookups keep
+        hitting fresh data. Indexes nobody used for index_max_age are dropped.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            # Only indexes of this reader: the store and its memory budget are shared with other backends
+            for index_key in list(self.index_sources):
+                index = self.indexes.peek(index_key)
+                if index is None:
+                    # Evicted to make room for other snapshots, the next lookup loads it again
+                    if index_key not in self.loading:
+                        self.forget_indexes([index_key])
+                    continue
+
+                ttl = self.index_sources[index_key][4]
+                if index.used_at < index.built_at:
+                    if index.is_expired(max(ttl, self.index_max_age)) and index_key not in self.loading:
+                        self.indexes.delete(index_key)
+                        self.forget_indexes([index_key])
+                elif index.is_expired(ttl):
+                    self.refresh_index(index_key, BACKGROUND)
+
+    def build_index(self, location, sheet, seek, columns, priority = INTERACTIVE, index_key = None, current = None,
+                    ttl = None):
+        """Get worksheet columns and build seek column index (blocking, runs on the worker pool).
+
+        With the disk store, the spreadsheet modification time is checked first: if the current index was downloaded
+        at the same one, it is returned as is without downloading. New snapshots are saved to disk.
+        """
+        marker = None
+        if self.disk_store is not None:
+            marker = self.get_marker(location, sheet, priority)
+            if current is not None and marker is not None and marker == current.marker:
+                self.disk_store.touch(index_key)
+                return current
+
+        if self.snapshot_cache is None:
+            values, age = self.download_columns(location, sheet, columns, priority), 0.0
+        else:
+            # The source's own freshness budget decides if the shared snapshot is fresh, not INDEX_TTL
+            values, age = self.snapshot_cache.fetch(location, sheet, columns, functools.partial(
+                self.download_columns, location, sheet, columns, priority), ttl)
+
+        index = SheetIndex(values, seek, age)
+        if self.disk_store is not None and index_key is not None:
+            # A snapshot another replica downloaded may predate the modification time just read
+            index.marker = marker if age == 0 else None
+            self.disk_store.save(index_key, values, index.marker, age)
+
+        return index
+
+    def restore_index(self, index_key, seek, ttl):
+        """Build index from the snapshot saved on disk (blocking, runs on the worker pool).
+
+        Returns:
+            SheetIndex or None if there is no saved snapshot
+        """
+        stored = self.disk_store.load(index_key)
+        if stored is None:
+            return None
+
+        values, marker, age = stored
+        # However long the bot was down, the snapshot counts as just gone stale: it is served under the
+        # stale-while-revalidate rules instead of making lookups wait past index_max_age
+        index = SheetIndex(values, seek, min(age, ttl))
+        index.marker = marker
+        index.restored = True
+
+        return index
+
+    def get_marker(self, location, sheet, priority = INTERACTIVE):
+        """Returns modification time of the spreadsheet from Google Drive, None if it is not available"""
         try:
-            requested_columns = [int(str(c).strip()) for c in columns]
-        except Exception:
-            raise Exception('Некорректный список колонок')
-        if not requested_columns:
-            raise Exception('Список колонок не должен быть пустым')
-        if not all(c > 0 for c in requested_columns):
-            raise Exception('Номера колонок должны быть положительными числами')
+            spreadsheet = self.get_worksheet(location, sheet, priority).spreadsheet
+            return self.quota.call(priority, spreadsheet.get_lastUpdateTime, operation='modified_time')
+        except Exception as e:
+            # E.g. the Drive API is not enabled for the service account, snapshots are then always downloaded
+            self.logger.debug('Spreadsheet modification time is not available: %s', e)
+            return None
 
+    def download_columns(self, location, sheet, columns, priority = INTERACTIVE):
+        """Download worksheet columns from Google.
+
+        Args:
+            location: Google Spreadsheet URL
+            sheet: 1-based worksheet index
+            columns: list of 1-based column indexes
+            priority: quota priority, or a function returning it when it can change while the call waits
+
+        Returns:
+            dict of {1-based column index: column values}, the first value of each column is its header,
+            columns past the width of the worksheet are empty
+        """
+        worksheet = self.get_worksheet(location, sheet, priority)
+        if max(columns) > worksheet.col_count:
+            # The worksheet may have grown since it was opened, its current width is checked before leaving columns out
+            worksheet = self.get_worksheet(location, sheet, priority, reopen=True)
+        # Ranges past the grid are rejected by the API with 400, those columns are simply empty
+        present = [col for col in columns if col <= worksheet.col_count]
+        values = {col: [] for col in columns}
+        if not present:
+            return values
+
+        # Header row comes with every column range, so one batched request fetches all we need
+        ranges = [self.column_range(col) for col in present]
+        value_ranges = self.quota.call(priority, worksheet.batch_get, ranges, major_dimension='COLUMNS',
+                                       operation='batch_get')
+
+        # Empty columns come back without values, trailing empty cells are trimmed
+        for col, value_range in zip(present, value_ranges):
+            values[col] = [str(v) for v in value_range[0]] if value_range else []
+
+        return values
+
+    @staticmethod
+    def column_range(col):
+        """Returns A1 notation range of the whole 1-based column, e.g. 3 -> 'C:C'"""
+        letter = re.sub(r'\d+', '', gspread.utils.rowcol_to_a1(1, col))
+
+        return f"{letter}:{letter}"
+
+    def get_worksheet(self, location, sheet, priority = INTERACTIVE, reopen = False):
+        """Return worksheet handle, opening the spreadsheet on first use or when reopen is set"""
         # Cache worksheets by URL and sheet index key
         cache_key = f"{location}::sheet:{sheet}"
-        if cache_key not in self.sources:
-            spreadsheet = self.reader.open_by_url(location)
-            # gspread uses 0-based worksheet index
-            worksheet = spreadsheet.get_worksheet(int(sheet) - 1)
+        if reopen or cache_key not in self.sources:
+            spreadsheet = self.quota.call(priority, self.reader.open_by_url, location, operation='open')
+            # gspread uses 0-based worksheet index, looking it up fetches the spreadsheet metadata
+            worksheet = self.quota.call(priority, spreadsheet.get_worksheet, int(sheet) - 1, operation='open')
             if worksheet is None:
                 raise Exception('Лист с указанным номером не найден')
             self.sources[cache_key] = worksheet
 
-        worksheet = self.sources[cache_key]
-
-        # Fetch all data
-        values = worksheet.get_all_values()
-        if not values or len(values) < 2:
-            return {}
-
-        headers = values[0]
-        # Ensure headers list is at least as long as the largest requested column
-        max_col = max(max(requested_columns), seek_col_index)
-        if len(headers) < max_col:
-            # pad headers to avoid index errors; unnamed columns will use default names later
-            headers = headers + [''] * (max_col - len(headers))
-
-        # Convert 1-based indices to 0-based
-        seek_idx0 = seek_col_index - 1
-
-        # Find the row where the seek column equals the key
-        target_row = None
-        for row in values[1:]:
-            if seek_idx0 < len(row) and str(row[seek_idx0]) == str(key):
-                target_row = row
-                break
+        return self.sources[cache_key]
 
-        if target_row is None:
-            return {}
+    def close(self):
+        """Stop worker pool, close shared snapshot cache and disk store"""
+        super().close()
 
-        result = {}
-        for col in requested_columns:
-            idx0 = col - 1
-            header = str.capitalize(headers[idx0]) if idx0 < len(headers) and headers[idx0] != '' else f"Column {col}"
-            value = target_row[idx0] if idx0 < len(target_row) else ''
-            result[header] = value
+        if self.snapshot_cache:
+            self.snapshot_cache.close()
 
-        return result
+        if self.disk_store:
+            self.disk_store.close()
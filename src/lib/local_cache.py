@@ -0,0 +1,71 @@
+"""
+In-process cache with bounded size and time to live, least recently used entries are evicted first
+"""
+import time
+from collections import OrderedDict
+from . import metrics
+
+
+class LocalCache:
+    max_size = 1000
+    ttl = 60
+    hits = 0
+    misses = 0
+
+    def __init__(self, max_size=1000, ttl=60, name=None):
+        """
+        Args:
+            max_size: maximum number of entries, 0 disables caching
+            ttl: seconds an entry stays valid
+            name: cache name to report hits and misses to metrics under, None to not report them
+        """
+        self.max_size = int(max_size)
+        self.ttl = float(ttl)
+        self.entries = OrderedDict()
+        self.hit_counter = metrics.CACHE_REQUESTS.labels(name, 'hit') if name else None
+        self.miss_counter = metrics.CACHE_REQUESTS.labels(name, 'miss') if name else None
+
+    def get(self, key, default=None):
+        """Returns cached value or default if it is missing or expired"""
+        entry = self.entries.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            if self.miss_counter:
+                self.miss_counter.inc()
+
+            return default
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        if self.hit_counter:
+            self.hit_counter.inc()
+
+        return entry[0]
+
+    def set(self, key, value, ttl=None):
+        """Stores value, evicting least recently used entries above max_size"""
+        if self.max_size <= 0:
+            return
+
+        self.entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def delete(self, key):
+        """Drops the entry if it is cached"""
+        self.entries.pop(key, None)
+
+    def delete_where(self, predicate):
+        """Drops all entries whose key matches predicate(key)"""
+        for key in [key for key in self.entries if predicate(key)]:
+            del self.entries[key]
+
+    def clear(self):
+        """Drops all entries"""
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,58 @@
+"""
+Prometheus metrics of the bot hot paths: commands, Google Sheets, index lookups, Redis, Telegram API and caches
+"""
+import time
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from telegram.request import HTTPXRequest
+
+# Lookups in memory take microseconds, network calls take up to seconds
+FAST_BUCKETS = (.000005, .00001, .000025, .00005, .0001, .00025, .0005, .001, .0025, .005, .01)
+NETWORK_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+COMMANDS = Counter('bot_commands', 'Commands dispatched', ['command'])
+COMMAND_DURATION = Histogram('bot_command_duration_seconds', 'Command handling time', ['command'],
+                             buckets=NETWORK_BUCKETS)
+HANDLERS_IN_FLIGHT = Gauge('bot_handlers_in_flight', 'Command handlers running right now')
+
+GOOGLE_REQUEST_DURATION = Histogram('bot_google_request_duration_seconds', 'Google Sheets API calls', ['operation'],
+                                    buckets=NETWORK_BUCKETS)
+GOOGLE_CALLS_QUEUED = Counter('bot_google_calls_queued', 'Google Sheets API calls that waited for the read quota',
+                              ['priority'])
+GOOGLE_QUOTA_WAIT = Histogram('bot_google_quota_wait_seconds', 'Time Google Sheets API calls waited for the read quota',
+                              ['priority'], buckets=NETWORK_BUCKETS)
+GOOGLE_CALLS_THROTTLED = Counter('bot_google_calls_throttled', 'Google Sheets API calls answered with 429 or 5xx',
+                                 ['code'])
+INDEX_LOOKUP_DURATION = Histogram('bot_index_lookup_duration_seconds', 'Worksheet index lookups of one request',
+                                  buckets=FAST_BUCKETS)
+REDIS_COMMAND_DURATION = Histogram('bot_redis_command_duration_seconds', 'Redis round trips', ['command'],
+                                   buckets=NETWORK_BUCKETS)
+TELEGRAM_REQUEST_DURATION = Histogram('bot_telegram_request_duration_seconds', 'Telegram Bot API calls', ['method'],
+                                      buckets=NETWORK_BUCKETS)
+
+SNAPSHOT_MEMORY = Gauge('bot_snapshot_memory_bytes', 'Estimated memory held by worksheet snapshots in this process')
+SNAPSHOT_EVICTIONS = Counter('bot_snapshot_evictions', 'Worksheet snapshots evicted to stay within the memory budget')
+
+WARMUP_READY = Gauge('bot_warmup_ready', 'Set to 1 once worksheets of all configured sources are preloaded')
+WARMUP_SOURCES = Counter('bot_warmup_sources', 'Sources preloaded at startup', ['result'])
+
+# result is hit, miss, or for the worksheet index also coalesced (joined a load already in flight), stale and
+# unchanged (revalidated against the spreadsheet modification time without downloading)
+CACHE_REQUESTS = Counter('bot_cache_requests', 'Cache lookups', ['cache', 'result'])
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """Telegram Bot API transport that records the duration of every call by API method"""
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        start = time.perf_counter()
+        try:
+            return await super().do_request(url, method, request_data, *args, **kwargs)
+        finally:
+            TELEGRAM_REQUEST_DURATION.labels(api_method).observe(time.perf_counter() - start)
+
+
+def start_server(port, addr='0.0.0.0'):
+    """Expose metrics on http://addr:port/metrics from a background thread"""
+    start_http_server(int(port), addr=addr)
@@ -1,15 +1,34 @@
 """
 Simple options class
 """
+import logging
+from .local_cache import LocalCache
 from .redis import Redis
 
+# Marks a cache miss, None and other falsy values are valid cached options
+MISSING = object()
+
 
 class Options():
+    logger = logging.getLogger(__name__)
     valid_options = {}
     valid_types = ['bool', 'int', 'str', 'dict']
+    # Storage keys of changed options are published here so every process drops them from its local cache
+    invalidation_channel = 'options:invalidate'
+    cache = None
+    cache_generation = 0
+
+    def __init__(self, setup, redis_host='localhost', redis_port=6379, redis_password=None,
+                 cache_size=1000, cache_ttl=60, redis_client=None):
+        self.redis = Redis(host=redis_host, port=redis_port, password=redis_password, client=redis_client)
+        self.cache = LocalCache(cache_size, cache_ttl, name='options')
+        # Each instance has its own options, setups of different instances don't mix
+        self.valid_options = {}
+        self.load_setup(setup)
+        self.migrate_dict_options()
 
-    def __init__(self, setup, redis_host='localhost', redis_port=6379, redis_password=None):
-        self.redis = Redis(host=redis_host, port=redis_port, password=redis_password)
+    def load_setup(self, setup):
+        """ Validates options setup and registers the options """
         for option_name in setup:
             if 'type' not in setup[option_name] or setup[option_name]['type'] not in self.valid_types:
                 raise Exception('Invalid option type')
@@ -40,70 +59,220 @@ class Options():
 
     def get_option(self, user_id, option_name, option_key = None):
         """ Returns option value """
-        if option_name not in self.valid_options:
-            raise Exception(f'Unknown option name: {option_name}')
+        return self.run(self.get_option_steps(user_id, option_name, option_key))
 
-        if self.valid_options[option_name]['type'] == 'dict' and option_key is None:
-            raise Exception(f'Need option key for {option_name}')
+    def resolve_option(self, user_id, option_name, dict_option_name):
+        """ Returns (str option value, dict option value under that key) with at most one storage round trip """
+        return self.run(self.resolve_option_steps(user_id, option_name, dict_option_name))
+
+    def set_option(self, user_id, option_name, option_value, option_key = None):
+        """ Store option value """
+        return self.run(self.set_option_steps(user_id, option_name, option_value, option_key))
+
+    def delete_option(self, user_id, option_name, option_key = None):
+        """ Delete stored option value, so the default is returned again """
+        return self.run(self.delete_option_steps(user_id, option_name, option_key))
+
+    def get_option_items(self, user_id, option_name):
+        """ Returns all {key: value} pairs of a dict option """
+        return self.run(self.get_option_items_steps(user_id, option_name))
+
+    def migrate_dict_options(self):
+        """ One-shot migration of dict options stored as JSON documents to hashes, keys already converted are skipped """
+        return self.run(self.migrate_dict_options_steps())
+
+    def run(self, steps):
+        """ Runs an operation, replies of its storage calls are sent back to it as they are """
+        reply = None
+        try:
+            while True:
+                reply = steps.send(reply)
+        except StopIteration as stop:
+            return stop.value
+
+    # Operations below yield their storage calls and get the replies back from run(), so the
+    # same code serves the blocking client here and the asyncio one in AsyncOptions
+
+    def get_option_steps(self, user_id, option_name, option_key):
+        self.check_option(option_name, option_key)
 
         storage_key = self.get_storage_key(user_id, option_name, option_key)
+        value = self.cache.get((storage_key, option_key), MISSING)
+        if value is not MISSING:
+            return value
 
+        generation = self.cache_generation
         if self.valid_options[option_name]['type'] == 'dict':
-            # For dict type, get the entire dict and return the specific key
-            result = self.redis.get_dict(storage_key)
-            if result is not None and option_key in result:
-                return result[option_key]
-            elif result is not None:
-                return {}
+            # Dict type is a hash, read just the requested field
+            value = self.decode_dict_value(option_name, (yield self.redis.hget(storage_key, option_key)))
         else:
             # For other types, get the value directly
-            result = self.redis.get(storage_key)
-            if result is not None:
-                # Convert string back to appropriate type
-                match self.valid_options[option_name]['type']:
-                    case 'bool':
-                        return result.lower() in ('true', '1', 'yes', 'on')
-                    case 'int':
-                        return int(result)
-                    case 'str':
-                        return result
-
-        # Return default value if not found in Redis
-        if option_name in self.valid_options and 'default' in self.valid_options[option_name]:
-            return self.valid_options[option_name]['default']
+            value = self.decode_value(option_name, (yield self.redis.get(storage_key)))
+
+        self.cache_value((storage_key, option_key), value, generation)
+
+        return value
+
+    def resolve_option_steps(self, user_id, option_name, dict_option_name):
+        self.check_reference(option_name, dict_option_name)
+
+        storage_key = self.get_storage_key(user_id, option_name, None)
+        dict_storage_key = self.get_storage_key(user_id, dict_option_name, None)
+
+        option_key = self.cache.get((storage_key, None), MISSING)
+        if option_key is not MISSING:
+            value = self.cache.get((dict_storage_key, option_key), MISSING)
+            if value is not MISSING:
+                return option_key, value
+
+        generation = self.cache_generation
+        option_key, value = yield self.redis.get_referenced_field(storage_key, dict_storage_key,
+                                                                  str(self.get_default(option_name)))
+        value = self.decode_dict_value(dict_option_name, value)
+
+        self.cache_value((storage_key, None), option_key, generation)
+        self.cache_value((dict_storage_key, option_key), value, generation)
+
+        return option_key, value
+
+    def set_option_steps(self, user_id, option_name, option_value, option_key):
+        self.check_option(option_name, option_key)
+
+        storage_key = self.get_storage_key(user_id, option_name, option_key)
+
+        if self.valid_options[option_name]['type'] == 'dict':
+            # Dict type is a hash, the field is updated atomically without touching the others
+            yield self.redis.hset(storage_key, option_key, str(option_value))
+        else:
+            yield self.redis.set(storage_key, self.encode_value(option_name, option_value))
+
+        self.invalidate(storage_key)
+        yield self.redis.publish(self.invalidation_channel, storage_key)
+
+    def delete_option_steps(self, user_id, option_name, option_key):
+        self.check_option(option_name, option_key)
+
+        storage_key = self.get_storage_key(user_id, option_name, option_key)
+
+        if self.valid_options[option_name]['type'] == 'dict':
+            deleted = yield self.redis.hdel(storage_key, option_key)
+        else:
+            deleted = yield self.redis.delete(storage_key)
+
+        self.invalidate(storage_key)
+        yield self.redis.publish(self.invalidation_channel, storage_key)
+
+        return deleted
+
+    def get_option_items_steps(self, user_id, option_name):
+        self.check_option(option_name, '')
+        if self.valid_options[option_name]['type'] != 'dict':
+            raise Exception(f'Option {option_name} is not a dict')
+
+        storage_key = self.get_storage_key(user_id, option_name, None)
+
+        return (yield self.redis.get_hash(storage_key))
+
+    def migrate_dict_options_steps(self):
+        migrated = 0
+        for pattern in self.get_dict_storage_patterns():
+            storage_keys = (yield self.redis.scan_keys(pattern)) if pattern.endswith('*') else [pattern]
+            for storage_key in storage_keys:
+                result = yield self.redis.json_to_hash(storage_key)
+                if result == 1:
+                    migrated += 1
+                elif result < 0:
+                    self.logger.warning('Option %s is not a JSON object, left as is', storage_key)
+
+        if migrated:
+            self.invalidate()
+            self.logger.info('Migrated %d dict options to Redis hashes', migrated)
+
+        return migrated
+
+    def cache_value(self, cache_key, value, generation):
+        """ Caches value read from storage unless an invalidation arrived while it was being read """
+        if generation == self.cache_generation:
+            self.cache.set(cache_key, value)
+
+    def invalidate(self, storage_key = None):
+        """ Drops cached values of the storage key, or the whole cache if no key is given """
+        self.cache_generation += 1
+        if storage_key is None:
+            self.cache.clear()
         else:
+            self.cache.delete_where(lambda cache_key: cache_key[0] == storage_key)
+
+    def get_dict_storage_patterns(self):
+        """ Returns storage keys of global dict options and key patterns of per-user ones """
+        patterns = []
+        for option_name, option in self.valid_options.items():
+            if option['type'] == 'dict':
+                patterns.append(option_name if option['is_global_entity'] else option_name + ':*')
+
+        return patterns
+
+    def check_option(self, option_name, option_key):
+        """ Checks that the option exists and gets a key if it is a dict """
+        if option_name not in self.valid_options:
+            raise Exception(f'Unknown option name: {option_name}')
+
+        if self.valid_options[option_name]['type'] == 'dict' and option_key is None:
+            raise Exception(f'Need option key for {option_name}')
+
+    def check_reference(self, option_name, dict_option_name):
+        """ Checks that a str option can hold a key of the dict option """
+        self.check_option(option_name, None)
+        self.check_option(dict_option_name, '')
+
+        if self.valid_options[option_name]['type'] != 'str' or self.valid_options[dict_option_name]['type'] != 'dict':
+            raise Exception(f'Option {option_name} can not refer to {dict_option_name}')
+
+    def decode_value(self, option_name, result):
+        """ Converts stored string back to the option type, None gives the default value """
+        if result is not None:
+            # Convert string back to appropriate type
             match self.valid_options[option_name]['type']:
                 case 'bool':
-                    return False
+                    return result.lower() in ('true', '1', 'yes', 'on')
                 case 'int':
-                    return 0
+                    return int(result)
                 case 'str':
-                    return ''
-                case 'dict':
-                    return {}
+                    return result
 
-    def set_option(self, user_id, option_name, option_value, option_key = None):
-        """ Store option value """
-        if option_name not in self.valid_options:
-            raise Exception(f'Unknown option {option_name}')
+        return self.get_default(option_name)
 
-        if self.valid_options[option_name]['type'] == 'dict' and option_key is None:
-                raise Exception(f'Need option key for {option_name}')
+    def decode_dict_value(self, option_name, result):
+        """ Returns stored dict field value, None gives the default value """
+        if result is not None:
+            return result
 
-        storage_key = self.get_storage_key(user_id, option_name, option_key)
+        return self.get_default(option_name)
 
+    def encode_value(self, option_name, option_value):
+        """ Converts scalar option value to its stored form """
         match self.valid_options[option_name]['type']:
             case 'bool':
-                self.redis.set(storage_key, bool(option_value))
+                return bool(option_value)
             case 'int':
-                self.redis.set(storage_key, int(option_value))
+                return int(option_value)
             case 'str':
-                self.redis.set(storage_key, str(option_value))
-            case 'dict':
-                # For dict type, get existing dict, update it, and save back
-                existing_dict = self.redis.get_dict(storage_key) or {}
-                existing_dict[option_key] = str(option_value)
-                self.redis.set_dict(storage_key, existing_dict)
+                return str(option_value)
+
+    def get_default(self, option_name):
+        """ Returns default value of the option """
+        if option_name in self.valid_options and 'default' in self.valid_options[option_name]:
+            return self.valid_options[option_name]['default']
+        else:
+            match self.valid_options[option_name]['type']:
+                case 'bool':
+                    return False
+                case 'int':
+                    return 0
+                case 'str':
+                    return ''
+                case 'dict':
+                    return {}
 
     def get_storage_key(self, user_id, option_name, option_key):
         storage_key = option_name
@@ -0,0 +1,140 @@
+"""
+Quota scheduler for Google Sheets API calls: a token bucket shared by all worker threads, interactive calls
+get tokens before background ones, rate limited and failed calls are retried with exponential backoff and jitter
+"""
+import random
+import threading
+import time
+
+from gspread.exceptions import APIError
+
+from . import metrics
+
+# Lower value goes first
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BACKGROUND: 'background'}
+
+
+class QuotaScheduler:
+    rate = 1.0
+    burst = 10
+    max_retries = 5
+    base_delay = 1.0
+    max_delay = 32.0
+
+    def __init__(self, requests_per_minute=60, burst=10, max_retries=5, base_delay=1.0, max_delay=32.0):
+        """
+        Args:
+            requests_per_minute: sustained rate of calls, Google read quota is counted per minute, 0 for no limit
+            burst: calls allowed at once after a quiet period
+            max_retries: attempts to repeat a call answered with 429 or 5xx
+            base_delay: seconds before the first retry, doubled on every next one
+            max_delay: upper bound of the retry delay in seconds
+        """
+        self.rate = float(requests_per_minute) / 60
+        self.burst = max(1, int(burst))
+        self.max_retries = int(max_retries)
+        self.base_delay = float(base_delay)
+        self.max_delay = float(max_delay)
+
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+        self.condition = threading.Condition()
+        # priority -> number of threads waiting for a token
+        self.waiting = {priority: 0 for priority in PRIORITY_NAMES}
+
+    def acquire(self, priority=INTERACTIVE):
+        """Block the calling worker thread until a token is available for the priority.
+
+        Args:
+            priority: INTERACTIVE or BACKGROUND, or a function returning it, checked again while waiting
+
+        Returns:
+            seconds waited
+        """
+        if self.rate <= 0:
+            return 0
+
+        start = time.monotonic()
+        current = self.resolve(priority)
+        with self.condition:
+            self.waiting[current] += 1
+            try:
+                while True:
+                    # A background load may become urgent while it waits, e.g. when a lookup joins it
+                    resolved = self.resolve(priority)
+                    if resolved != current:
+                        self.waiting[current] -= 1
+                        self.waiting[resolved] += 1
+                        current = resolved
+
+                    self.refill()
+                    # Tokens go to more urgent waiters first
+                    ahead = any(self.waiting[other] for other in self.waiting if other < current)
+                    if self.tokens >= 1 and not ahead:
+                        self.tokens -= 1
+                        break
+
+                    # Wake up when the next token is due or when a more urgent waiter leaves
+                    self.condition.wait((1 - self.tokens) / self.rate if self.tokens < 1 else 0.1)
+            finally:
+                self.waiting[current] -= 1
+                self.condition.notify_all()
+
+        waited = time.monotonic() - start
+        if waited > 0.001:
+            metrics.GOOGLE_CALLS_QUEUED.labels(PRIORITY_NAMES[current]).inc()
+        metrics.GOOGLE_QUOTA_WAIT.labels(PRIORITY_NAMES[current]).observe(waited)
+
+        return waited
+
+    @staticmethod
+    def resolve(priority):
+        """Returns priority value of a priority or of a function returning it"""
+        return priority() if callable(priority) else priority
+
+    def refill(self):
+        """Add tokens earned since the last refill, must be called under the condition lock"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def call(self, priority, func, *args, operation=None, **kwargs):
+        """Run a blocking Google API call within the quota, retrying rate limited and server errors.
+
+        Args:
+            priority: INTERACTIVE or BACKGROUND, or a function returning it
+            func: the API call, called with the rest of the arguments
+            operation: label of the call latency histogram, only the call itself is timed: quota waits and
+                backoff sleeps would hide the API latency behind our own throttling
+
+        Returns:
+            result of the call
+        """
+        attempt = 0
+        while True:
+            self.acquire(priority)
+            try:
+                if operation is None:
+                    return func(*args, **kwargs)
+                with metrics.GOOGLE_REQUEST_DURATION.labels(operation).time():
+                    return func(*args, **kwargs)
+            except APIError as e:
+                if not self.is_retryable(e):
+                    raise
+
+                metrics.GOOGLE_CALLS_THROTTLED.labels(str(e.code)).inc()
+                if attempt >= self.max_retries:
+                    if e.code == 429:
+                        raise Exception('Превышена квота запросов к Google Sheets, попробуйте позже')
+                    raise
+
+                # Full jitter: replicas throttled at the same moment don't come back at the same moment
+                time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+                attempt += 1
+
+    @staticmethod
+    def is_retryable(error):
+        """Checks if the API error is rate limiting or a server side failure"""
+        return error.code == 429 or 500 <= error.code < 600
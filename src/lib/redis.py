@@ -3,11 +3,63 @@ Redis client class for storing and retrieving data
 """
 import redis
 import json
-from typing import Any, Optional
+import time
+import uuid
+from typing import Any, Iterator, Optional
+from . import metrics
+
+
+class InstrumentedClient(redis.Redis):
+    """redis-py client that records every round trip duration by command"""
+
+    def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            metrics.REDIS_COMMAND_DURATION.labels(args[0]).observe(time.perf_counter() - start)
 
 
 class Redis:
-    def __init__(self, host: str = 'localhost', port: int = 6379, db: int = 0, password: str = None):
+    # Delete the lock only if it still holds our token, so an expired lock taken over by another client survives
+    RELEASE_LOCK_SCRIPT = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('del', KEYS[1])
+        end
+        return 0
+    """
+
+    # Converts legacy JSON document stored as a string into a hash with the same fields, atomically
+    JSON_TO_HASH_SCRIPT = """
+        if redis.call('type', KEYS[1]).ok ~= 'string' then
+            return 0
+        end
+        -- A value that is not a JSON object is kept as is, it must not abort the startup migration
+        local ok, document = pcall(cjson.decode, redis.call('get', KEYS[1]))
+        if not ok or type(document) ~= 'table' or #document > 0 then
+            return -1
+        end
+        redis.call('del', KEYS[1])
+        for field, value in pairs(document) do
+            -- JSON null means no value, the field is left out rather than stored as a userdata string
+            if value ~= cjson.null then
+                if type(value) == 'table' then
+                    value = cjson.encode(value)
+                end
+                redis.call('hset', KEYS[1], field, tostring(value))
+            end
+        end
+        return 1
+    """
+
+    # Reads a string holding a hash field name and that field of the hash in one round trip
+    GET_REFERENCED_FIELD_SCRIPT = """
+        local field = redis.call('get', KEYS[1]) or ARGV[1]
+        return {field, redis.call('hget', KEYS[2], field)}
+    """
+
+    def __init__(self, host: str = 'localhost', port: int = 6379, db: int = 0, password: str = None,
+                 client=None, binary_client=None):
         """
         Initialize Redis connection
         
@@ -16,29 +68,95 @@ class Redis:
             port: Redis server port
             db: Redis database number
             password: Redis password (optional)
+            client: Ready redis.Redis compatible client with decoded responses to use instead of connecting, e.g. fakeredis
+            binary_client: Client of the same server without response decoding, for binary payloads
         """
         self.host = host
         self.port = port
         self.db = db
         self.password = password
-        self.client = None
-        self._connect()
+        self.client = client
+        self.binary_client = binary_client
+        if client is None:
+            self._connect()
+        else:
+            self.register_scripts()
+    
+    def register_scripts(self):
+        """Register scripts of the hot path on the client"""
+        # Hot path script goes by SHA, the body is only sent when the server doesn't know it yet
+        self.get_referenced_field_script = self.client.register_script(self.GET_REFERENCED_FIELD_SCRIPT)
     
     def _connect(self):
         """Establish connection to Redis server"""
         try:
-            self.client = redis.Redis(
+            self.client = InstrumentedClient(
                 host=self.host,
                 port=self.port,
                 db=self.db,
                 password=self.password,
                 decode_responses=True
             )
+            # Same server without response decoding, for compressed and other binary payloads
+            self.binary_client = InstrumentedClient(
+                host=self.host,
+                port=self.port,
+                db=self.db,
+                password=self.password
+            )
+            self.register_scripts()
             # Test connection
             self.client.ping()
         except redis.ConnectionError as e:
             raise Exception(f"Failed to connect to Redis at {self.host}:{self.port}: {e}")
     
+    def execute(self, error: str, convert, func, *args, **kwargs) -> Any:
+        """
+        Run a client command, the only place commands wait for the server: AsyncRedis awaits them here
+        
+        Args:
+            error: Message of the exception raised when the command fails
+            convert: Function applied to the reply, None to return it as is
+            func: Client command or registered script
+        
+        Returns:
+            Converted reply
+        """
+        try:
+            reply = func(*args, **kwargs)
+        except redis.RedisError as e:
+            raise Exception(f"{error}: {e}")
+        
+        return reply if convert is None else convert(reply)
+    
+    @staticmethod
+    def encode(value: Any) -> str:
+        """Returns stored form of a value: JSON for dicts and lists, string for the rest"""
+        if isinstance(value, (dict, list)):
+            return json.dumps(value)
+        
+        return str(value)
+    
+    @staticmethod
+    def decode_dict(value: Optional[str]) -> Optional[dict]:
+        """Returns dictionary of a stored JSON value, None if there is no value or it is not valid JSON"""
+        if value is None:
+            return None
+        
+        try:
+            return json.loads(value)
+        except json.JSONDecodeError:
+            return None
+    
+    def ping(self) -> bool:
+        """
+        Check connection to Redis server
+        
+        Returns:
+            True if the server replies
+        """
+        return self.execute(f"Failed to connect to Redis at {self.host}:{self.port}", None, self.client.ping)
+    
     def get(self, key: str) -> Optional[str]:
         """
         Get value from Redis by key
@@ -49,10 +167,7 @@ class Redis:
         Returns:
             Value as string or None if key doesn't exist
         """
-        try:
-            return self.client.get(key)
-        except redis.RedisError as e:
-            raise Exception(f"Failed to get value from Redis: {e}")
+        return self.execute("Failed to get value from Redis", None, self.client.get, key)
     
     def set(self, key: str, value: Any, expire: Optional[int] = None) -> bool:
         """
@@ -66,19 +181,10 @@ class Redis:
         Returns:
             True if successful
         """
-        try:
-            # Convert value to string
-            if isinstance(value, (dict, list)):
-                value = json.dumps(value)
-            else:
-                value = str(value)
-            
-            if expire:
-                return self.client.setex(key, expire, value)
-            else:
-                return self.client.set(key, value)
-        except redis.RedisError as e:
-            raise Exception(f"Failed to set value in Redis: {e}")
+        if expire:
+            return self.execute("Failed to set value in Redis", None, self.client.setex, key, expire, self.encode(value))
+        
+        return self.execute("Failed to set value in Redis", None, self.client.set, key, self.encode(value))
     
     def delete(self, key: str) -> bool:
         """
@@ -90,10 +196,7 @@ class Redis:
         Returns:
             True if key was deleted, False if key didn't exist
         """
-        try:
-            return bool(self.client.delete(key))
-        except redis.RedisError as e:
-            raise Exception(f"Failed to delete key from Redis: {e}")
+        return self.execute("Failed to delete key from Redis", bool, self.client.delete, key)
     
     def exists(self, key: str) -> bool:
         """
@@ -105,10 +208,7 @@ class Redis:
         Returns:
             True if key exists, False otherwise
         """
-        try:
-            return bool(self.client.exists(key))
-        except redis.RedisError as e:
-            raise Exception(f"Failed to check key existence in Redis: {e}")
+        return self.execute("Failed to check key existence in Redis", bool, self.client.exists, key)
     
     def get_dict(self, key: str) -> Optional[dict]:
         """
@@ -120,14 +220,7 @@ class Redis:
         Returns:
             Dictionary or None if key doesn't exist or value is not valid JSON
         """
-        value = self.get(key)
-        if value is None:
-            return None
-        
-        try:
-            return json.loads(value)
-        except json.JSONDecodeError:
-            return None
+        return self.execute("Failed to get value from Redis", self.decode_dict, self.client.get, key)
     
     def set_dict(self, key: str, value: dict, expire: Optional[int] = None) -> bool:
         """
@@ -143,7 +236,196 @@ class Redis:
         """
         return self.set(key, value, expire)
     
+    def hget(self, key: str, field: str) -> Optional[str]:
+        """
+        Get hash field value
+        
+        Args:
+            key: Redis key of the hash
+            field: Field name
+        
+        Returns:
+            Value as string or None if the field doesn't exist
+        """
+        return self.execute("Failed to get hash field from Redis", None, self.client.hget, key, field)
+    
+    def hset(self, key: str, field: str, value: Any) -> bool:
+        """
+        Set hash field value, other fields are left untouched
+        
+        Args:
+            key: Redis key of the hash
+            field: Field name
+            value: Value to store (will be converted to string)
+        
+        Returns:
+            True if the field is new, False if it was updated
+        """
+        return self.execute("Failed to set hash field in Redis", bool, self.client.hset, key, field, str(value))
+    
+    def hdel(self, key: str, field: str) -> bool:
+        """
+        Delete hash field
+        
+        Args:
+            key: Redis key of the hash
+            field: Field name
+        
+        Returns:
+            True if field was deleted, False if it didn't exist
+        """
+        return self.execute("Failed to delete hash field from Redis", bool, self.client.hdel, key, field)
+    
+    def hscan(self, key: str, count: int = 100) -> Iterator[tuple]:
+        """
+        Iterate hash fields in batches without blocking the server on big hashes
+        
+        Args:
+            key: Redis key of the hash
+            count: Fields fetched per round trip
+        
+        Returns:
+            Iterator of (field, value) tuples
+        """
+        try:
+            for item in self.client.hscan_iter(key, count=count):
+                yield item
+        except redis.RedisError as e:
+            raise Exception(f"Failed to scan hash in Redis: {e}")
+    
+    def get_hash(self, key: str, count: int = 100) -> dict:
+        """
+        Get all fields of a hash, read in batches like hscan
+        
+        Args:
+            key: Redis key of the hash
+            count: Fields fetched per round trip
+        
+        Returns:
+            Dictionary of field values
+        """
+        return dict(self.hscan(key, count))
+    
+    def scan_keys(self, match: str, count: int = 100) -> list:
+        """
+        Find keys by glob pattern without blocking the server
+        
+        Args:
+            match: Key pattern, e.g. 'sources:*'
+            count: Keys checked per round trip
+        
+        Returns:
+            List of matching keys
+        """
+        try:
+            return [key for key in self.client.scan_iter(match=match, count=count)]
+        except redis.RedisError as e:
+            raise Exception(f"Failed to scan keys in Redis: {e}")
+    
+    def json_to_hash(self, key: str) -> int:
+        """
+        Convert JSON dictionary stored as a plain value into a hash
+        
+        Args:
+            key: Redis key
+        
+        Returns:
+            1 if the key was converted, 0 if it is not a plain value,
+            -1 if the value is not a JSON object and was left as is
+        """
+        return self.execute(f"Failed to convert {key} to hash in Redis", int,
+                            self.client.eval, self.JSON_TO_HASH_SCRIPT, 1, key)
+    
+    def get_referenced_field(self, key: str, hash_key: str, default_field: str) -> tuple:
+        """
+        Get hash field whose name is stored under another key, in one round trip
+        
+        Args:
+            key: Redis key holding the field name
+            hash_key: Redis key of the hash
+            default_field: Field name to use when key doesn't exist
+        
+        Returns:
+            Tuple of (field name, value or None if the field doesn't exist)
+        """
+        return self.execute("Failed to get referenced hash field from Redis", tuple,
+                            self.get_referenced_field_script, keys=[key, hash_key], args=[default_field])
+    
+    def publish(self, channel: str, message: str) -> int:
+        """
+        Publish message to a pub/sub channel
+        
+        Args:
+            channel: Channel name
+            message: Message text
+            
+        Returns:
+            Number of subscribers that received the message
+        """
+        return self.execute("Failed to publish to Redis", None, self.client.publish, channel, message)
+    
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        """
+        Get raw binary value from Redis by key
+        
+        Args:
+            key: Redis key
+            
+        Returns:
+            Value as bytes or None if key doesn't exist
+        """
+        return self.execute("Failed to get value from Redis", None, self.binary_client.get, key)
+    
+    def set_bytes(self, key: str, value: bytes, expire: Optional[int] = None) -> bool:
+        """
+        Set raw binary value in Redis by key
+        
+        Args:
+            key: Redis key
+            value: Bytes to store as is
+            expire: Optional expiration time in seconds
+            
+        Returns:
+            True if successful
+        """
+        if expire:
+            return self.execute("Failed to set value in Redis", None, self.binary_client.setex, key, expire, value)
+        
+        return self.execute("Failed to set value in Redis", None, self.binary_client.set, key, value)
+    
+    def acquire_lock(self, key: str, ttl: int) -> Optional[str]:
+        """
+        Acquire a lock shared by all clients of the Redis server
+        
+        Args:
+            key: Lock key
+            ttl: Lock lifetime in seconds, the lock is released automatically after it
+            
+        Returns:
+            Lock token to pass to release_lock() or None if the lock is held by someone else
+        """
+        token = uuid.uuid4().hex
+        
+        return self.execute("Failed to acquire lock in Redis", lambda acquired: token if acquired else None,
+                            self.client.set, key, token, nx=True, ex=ttl)
+    
+    def release_lock(self, key: str, token: str) -> bool:
+        """
+        Release lock if it is still held with the given token
+        
+        Args:
+            key: Lock key
+            token: Token returned by acquire_lock()
+            
+        Returns:
+            True if the lock was released, False if it has expired or was taken over
+        """
+        return self.execute("Failed to release lock in Redis", bool,
+                            self.client.eval, self.RELEASE_LOCK_SCRIPT, 1, key, token)
+    
     def close(self):
         """Close Redis connection"""
         if self.client:
             self.client.close()
+        if self.binary_client:
+            self.binary_client.close()
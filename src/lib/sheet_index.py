@@ -0,0 +1,203 @@
+"""
+Worksheet index: maps values of the seek column, or tuples of values of several seek columns, to rows of
+a projected worksheet snapshot
+
+Columns with repeated values (statuses, cities, dates) are stored compactly: each distinct value is kept once and
+the column is an array of small integer codes pointing into the list of its distinct values. Mostly unique columns
+(ids, names) gain nothing from that and stay plain lists.
+"""
+import bisect
+import itertools
+import re
+import sys
+import time
+from array import array
+
+
+# Process wide snapshot numbering, a reloaded worksheet never gets the version of a previous snapshot
+VERSIONS = itertools.count(1)
+
+
+class SheetIndex:
+    seek = 1
+    version = 0
+    headers = {}
+    columns = {}
+    rows = {}
+    built_at = 0.0
+    # Monotonic time of the last lookup through GspreadReader, tells busy indexes from idle ones
+    used_at = 0.0
+    # Sorted normalized seek values and their rows, built on demand by build_search_index
+    search_keys = None
+    search_rows = None
+    # Array type of search_rows, indexes whose rows are byte offsets need 64 bits
+    row_typecode = 'I'
+    # Estimated memory footprint in bytes, see memory_size
+    size = None
+    # Spreadsheet modification time the snapshot was downloaded at, None if unknown
+    marker = None
+    # Restored from the disk store and not yet checked against the spreadsheet
+    restored = False
+
+    def __init__(self, columns, seek, age=0.0):
+        """Build index from projected worksheet snapshot.
+
+        Args:
+            columns: dict of {1-based column index: column cell strings}, the first value of each column is its header
+            seek: 1-based column index to index rows by, or a tuple of them for a composite key
+            age: seconds since the snapshot was downloaded
+        """
+        self.seek = seek
+        self.version = next(VERSIONS)
+        self.headers = {col: (str(values[0]) if values else '') for col, values in columns.items()}
+        cells = {col: values[1:] for col, values in columns.items()}
+        self.columns = {col: self.compact(values) for col, values in cells.items()}
+
+        if isinstance(seek, tuple):
+            # Composite key: one hash probe by the tuple of cell values
+            row_count = max((len(cells[col]) for col in seek if col in cells), default=0)
+            keys = [tuple(self.get_value(row, col) for col in seek) for row in range(row_count)]
+        else:
+            keys = cells.get(seek, [])
+
+        # Filled bottom up, so the first matching row wins, same as a top-down scan
+        self.rows = dict(zip(reversed(keys), range(len(keys) - 1, -1, -1)))
+
+        self.built_at = time.monotonic() - age
+
+    @staticmethod
+    def compact(values, samples=1000):
+        """Returns (distinct values, array of their codes by row) of a column of cell strings,
+        (values, None) if most of the values are unique"""
+        sample = values[::max(1, len(values) // samples)]
+        if len(set(sample)) * 2 > len(sample):
+            return values, None
+
+        # Built from C level primitives only, columns of big sheets have hundreds of thousands of cells
+        distinct = list(dict.fromkeys(values))
+        positions = dict(zip(distinct, range(len(distinct))))
+
+        # Narrowest integer type that fits the number of distinct values
+        typecode = 'B' if len(distinct) <= 0xFF else 'H' if len(distinct) <= 0xFFFF else 'I'
+
+        return distinct, array(typecode, map(positions.__getitem__, values))
+
+    def lookup(self, key):
+        """Returns 0-based data row number for the key (tuple of values for a composite key) or None"""
+        if isinstance(key, tuple):
+            return self.rows.get(tuple(str(part) for part in key))
+
+        return self.rows.get(str(key))
+
+    @staticmethod
+    def normalize(value):
+        """Returns search form of a value: case folded, without whitespace and leading zeros, e.g. ' 007 ab' -> '7ab'"""
+        value = re.sub(r'\s+', '', str(value)).casefold()
+        stripped = value.lstrip('0')
+
+        return stripped if stripped or not value else '0'
+
+    @classmethod
+    def normalize_key(cls, key):
+        """Returns search form of a key, parts of a composite key are normalized one by one and joined"""
+        if isinstance(key, tuple):
+            # Separator sorts before any character, so a whole part compares as a prefix of a longer one
+            return '\0'.join(cls.normalize(part) for part in key)
+
+        return cls.normalize(key)
+
+    def build_search_index(self):
+        """Build sorted index of normalized seek values for normalized and prefix lookups (blocking on big sheets)"""
+        if self.search_keys is not None:
+            return
+
+        entries = sorted((self.normalize_key(key), row) for key, row in self.rows.items())
+        self.search_rows = array(self.row_typecode, (row for _, row in entries))
+        self.search_keys = [key for key, _ in entries]
+        self.size = None
+
+    def lookup_normalized(self, key):
+        """Returns the first data row whose normalized seek value equals the normalized key or None"""
+        rows = self.search(key, exact=True, limit=None)
+
+        return min(rows) if rows else None
+
+    def search(self, prefix, limit=10, exact=False):
+        """Returns data rows whose normalized seek value starts with (or equals) the normalized prefix.
+
+        Args:
+            prefix: value typed by the user, for a composite key a tuple of leading parts
+            limit: max number of rows, None for all
+            exact: match whole values only
+
+        Returns:
+            list of 0-based data row numbers in the order of normalized values
+        """
+        self.build_search_index()
+        prefix = self.normalize_key(prefix)
+        if prefix.strip('\0') == '':
+            return []
+
+        start = bisect.bisect_left(self.search_keys, prefix)
+        if exact:
+            end = bisect.bisect_right(self.search_keys, prefix, start)
+        else:
+            # Every string with the prefix sorts before the prefix followed by the highest code point
+            end = bisect.bisect_left(self.search_keys, prefix + chr(0x10FFFF), start)
+
+        if limit is not None:
+            end = min(end, start + limit)
+
+        return self.search_rows[start:end].tolist()
+
+    def get_key(self, row):
+        """Returns seek column value of the data row, tuple of values for a composite key"""
+        if isinstance(self.seek, tuple):
+            return tuple(self.get_value(row, col) for col in self.seek)
+
+        return self.get_value(row, self.seek)
+
+    def get_header(self, col):
+        """Returns header of the 1-based column or '' if it is not set"""
+        return self.headers.get(col, '')
+
+    def get_value(self, row, col):
+        """Returns cell value of the data row in the 1-based column, '' for empty cells"""
+        values, codes = self.columns.get(col, ((), None))
+        if codes is None:
+            return values[row] if row < len(values) else ''
+
+        return values[codes[row]] if row < len(codes) else ''
+
+    def memory_size(self):
+        """Returns estimated memory footprint in bytes: strings, code arrays, the key map and the search index"""
+        if self.size is None:
+            # Keys of a single seek column are the strings of its column, tuples of a composite key are extra
+            size = sys.getsizeof(self.rows)
+            for distinct, codes in self.columns.values():
+                size += sys.getsizeof(distinct) + sys.getsizeof(codes) + self.objects_size(distinct)
+            if isinstance(self.seek, tuple):
+                size += self.objects_size(list(self.rows))
+            if self.search_keys is not None:
+                size += sys.getsizeof(self.search_keys) + sys.getsizeof(self.search_rows)
+                size += self.objects_size(self.search_keys)
+            self.size = int(size)
+
+        return self.size
+
+    @staticmethod
+    def objects_size(objects, samples=100):
+        """Returns estimated total size of the objects, measured on an even sample of them"""
+        if not objects:
+            return 0
+
+        sample = objects[::max(1, len(objects) // samples)]
+
+        return sum(map(sys.getsizeof, sample)) * len(objects) / len(sample)
+
+    def is_expired(self, ttl):
+        """Checks if the index is older than ttl seconds"""
+        return time.monotonic() - self.built_at >= ttl
+
+    def __len__(self):
+        return len(self.rows)
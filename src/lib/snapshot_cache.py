@@ -0,0 +1,152 @@
+"""
+Shared worksheet snapshot cache: keeps compressed column projections in Redis so bot replicas don't download the same sheets
+"""
+import hashlib
+import json
+import logging
+import time
+import zlib
+from . import metrics
+
+
+class SnapshotCache:
+    logger = logging.getLogger(__name__)
+    # Bump when the payload layout changes, old snapshots are then simply ignored
+    format_version = 1
+
+    redis = None
+    ttl = 300
+    lock_ttl = 60
+    wait_timeout = 10
+    prefix = 'snapshot'
+
+    def __init__(self, redis, ttl=300, lock_ttl=60, wait_timeout=10):
+        """
+        Args:
+            redis: lib.redis.Redis instance
+            ttl: seconds a stored snapshot is considered fresh
+            lock_ttl: seconds a replica may hold the refresh lock
+            wait_timeout: seconds to wait for another replica's refresh before downloading the sheet ourselves
+        """
+        self.redis = redis
+        self.ttl = int(ttl)
+        self.lock_ttl = int(lock_ttl)
+        self.wait_timeout = wait_timeout
+
+    def get_key(self, location, sheet, columns):
+        """Returns Redis key of the (url, sheet, columns) projection"""
+        url_hash = hashlib.sha1(location.encode()).hexdigest()
+
+        return f"{self.prefix}:v{self.format_version}:{url_hash}:{sheet}:{','.join(map(str, columns))}"
+
+    def load(self, location, sheet, columns):
+        """Load snapshot of the projection.
+
+        Returns:
+            tuple of ({column: values}, age in seconds) or None if there is no usable snapshot
+        """
+        try:
+            payload = self.redis.get_bytes(self.get_key(location, sheet, columns))
+        except Exception as e:
+            self.report_error(e)
+            return None
+        if payload is None:
+            return None
+
+        try:
+            snapshot = json.loads(zlib.decompress(payload))
+        except (zlib.error, ValueError):
+            return None
+
+        if snapshot.get('format') != self.format_version:
+            return None
+
+        values = {int(col): column for col, column in snapshot['columns'].items()}
+
+        return values, max(0.0, time.time() - snapshot['saved_at'])
+
+    def save(self, location, sheet, columns, values, ttl=None):
+        """Store snapshot of the projection, kept for a while past ttl, the freshness budget of the source"""
+        snapshot = {
+            'format': self.format_version,
+            'saved_at': time.time(),
+            'columns': {str(col): column for col, column in values.items()},
+        }
+        payload = zlib.compress(json.dumps(snapshot, ensure_ascii=False, separators=(',', ':')).encode())
+
+        # Stale snapshots outlive their freshness for a while: replicas serve them while one of them refreshes
+        ttl = self.ttl if ttl is None else max(self.ttl, int(ttl))
+        try:
+            self.redis.set_bytes(self.get_key(location, sheet, columns), payload, ttl * 2 + self.lock_ttl)
+        except Exception as e:
+            # E.g. Redis out of memory: the snapshot just downloaded is still served, only not shared
+            self.report_error(e)
+
+    def fetch(self, location, sheet, columns, download, ttl=None):
+        """Return projection from the shared cache, refreshing it with download() when it is stale.
+
+        Only one replica downloads at a time, the others serve the stale snapshot or wait for the fresh one.
+        The cache is optional: when Redis fails, the projection is downloaded as if there was no cache.
+
+        Args:
+            location: Google Spreadsheet URL
+            sheet: 1-based worksheet index
+            columns: sorted list of 1-based column indexes
+            download: callable returning {column: values} straight from Google
+            ttl: seconds the snapshot stays fresh for this source, None for the cache ttl
+
+        Returns:
+            tuple of ({column: values}, age in seconds)
+        """
+        ttl = self.ttl if ttl is None else float(ttl)
+        cached = self.load(location, sheet, columns)
+        if cached is not None and cached[1] < ttl:
+            metrics.CACHE_REQUESTS.labels('snapshot', 'hit').inc()
+            return cached
+
+        metrics.CACHE_REQUESTS.labels('snapshot', 'miss' if cached is None else 'stale').inc()
+        lock_key = self.get_key(location, sheet, columns) + ':lock'
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            try:
+                token = self.redis.acquire_lock(lock_key, self.lock_ttl)
+            except Exception as e:
+                self.report_error(e)
+                return download(), 0.0
+
+            if token is not None:
+                try:
+                    values = download()
+                    self.save(location, sheet, columns, values, ttl)
+
+                    return values, 0.0
+                finally:
+                    self.release_lock(lock_key, token)
+
+            # Somebody else is refreshing: a stale snapshot is good enough meanwhile
+            if cached is not None:
+                return cached
+
+            if time.monotonic() >= deadline:
+                return download(), 0.0
+
+            time.sleep(0.2)
+            cached = self.load(location, sheet, columns)
+            if cached is not None and cached[1] < ttl:
+                return cached
+
+    def release_lock(self, lock_key, token):
+        """Release the refresh lock, a lock Redis failed to release expires after lock_ttl"""
+        try:
+            self.redis.release_lock(lock_key, token)
+        except Exception as e:
+            self.report_error(e)
+
+    def report_error(self, error):
+        """Log a failed Redis call, lookups go on without the shared cache"""
+        metrics.CACHE_REQUESTS.labels('snapshot', 'error').inc()
+        self.logger.warning('Snapshot cache is not available: %s', error)
+
+    def close(self):
+        """Close Redis connection"""
+        self.redis.close()
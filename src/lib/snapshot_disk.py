@@ -0,0 +1,91 @@
+"""
+Persistent worksheet snapshot store: keeps column projections in a local SQLite file with the spreadsheet
+modification time they were downloaded at, so a restarted bot serves lookups before downloading anything
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from . import metrics
+
+
+class DiskSnapshotStore:
+    # Bump when the payload layout changes, old snapshots are then simply ignored
+    format_version = 1
+    # Seconds a snapshot nobody saved or revalidated is kept, sources removed from the bot go away with it
+    max_age = 7 * 24 * 3600
+
+    path = None
+    connection = None
+
+    def __init__(self, path, max_age=7 * 24 * 3600):
+        """
+        Args:
+            path: SQLite database file, created with its directory if missing
+            max_age: seconds to keep snapshots that were not saved or revalidated
+        """
+        self.path = path
+        self.max_age = max_age
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Used from the worker pool threads, one statement at a time
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        with self.lock:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS snapshots (key TEXT PRIMARY KEY, format INTEGER, '
+                                    'marker TEXT, saved_at REAL, payload BLOB)')
+            self.connection.execute('DELETE FROM snapshots WHERE saved_at < ?', (time.time() - self.max_age,))
+
+    def load(self, key):
+        """Load snapshot stored under the key.
+
+        Returns:
+            tuple of ({column: values}, marker, age in seconds) or None if there is no usable snapshot
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT format, marker, saved_at, payload FROM snapshots WHERE key = ?',
+                                          (key,)).fetchone()
+        if row is None or row[0] != self.format_version:
+            metrics.CACHE_REQUESTS.labels('disk_snapshot', 'miss').inc()
+            return None
+
+        try:
+            columns = json.loads(zlib.decompress(row[3]))
+        except (zlib.error, ValueError):
+            metrics.CACHE_REQUESTS.labels('disk_snapshot', 'miss').inc()
+            return None
+
+        metrics.CACHE_REQUESTS.labels('disk_snapshot', 'hit').inc()
+
+        return {int(col): values for col, values in columns.items()}, row[1], max(0.0, time.time() - row[2])
+
+    def save(self, key, values, marker=None, age=0.0):
+        """Store snapshot of the projection.
+
+        Args:
+            key: index key of the projection
+            values: dict of {1-based column index: column values}
+            marker: spreadsheet modification time the values were downloaded at, None if unknown
+            age: seconds since the values were downloaded
+        """
+        payload = zlib.compress(json.dumps({str(col): column for col, column in values.items()},
+                                           ensure_ascii=False, separators=(',', ':')).encode())
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?)',
+                                    (key, self.format_version, marker, time.time() - age, payload))
+
+    def touch(self, key):
+        """Mark the snapshot as checked against the spreadsheet just now"""
+        with self.lock:
+            self.connection.execute('UPDATE snapshots SET saved_at = ? WHERE key = ?', (time.time(), key))
+
+    def close(self):
+        """Close the database"""
+        if self.connection is not None:
+            with self.lock:
+                self.connection.close()
+            self.connection = None
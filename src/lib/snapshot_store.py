@@ -0,0 +1,87 @@
+"""
+Worksheet snapshot store: keeps SheetIndex objects of all sources within one memory budget,
+least recently used snapshots are evicted first
+"""
+from collections import OrderedDict
+from . import metrics
+
+
+class SnapshotStore:
+    max_bytes = 256 * 1024 * 1024
+    evictions = 0
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        """
+        Args:
+            max_bytes: memory budget of all snapshots, estimated by SheetIndex.memory_size
+        """
+        self.max_bytes = int(max_bytes)
+        self.entries = OrderedDict()
+
+    def get(self, key, default=None):
+        """Returns the snapshot and marks it as recently used"""
+        index = self.entries.get(key)
+        if index is None:
+            return default
+
+        self.entries.move_to_end(key)
+
+        return index
+
+    def peek(self, key):
+        """Returns the snapshot or None without marking it as recently used"""
+        return self.entries.get(key)
+
+    def set(self, key, index):
+        """Stores the snapshot, evicting least recently used ones above the budget.
+
+        Returns:
+            list of evicted keys, the snapshot just stored is kept even if it alone exceeds the budget
+        """
+        self.entries[key] = index
+        self.entries.move_to_end(key)
+
+        return self.evict()
+
+    def evict(self):
+        """Drops least recently used snapshots until the rest fits the budget, call again when a snapshot grows.
+
+        Returns:
+            list of evicted keys
+        """
+        evicted = []
+        total = self.memory_size()
+        while total > self.max_bytes and len(self.entries) > 1:
+            key, index = self.entries.popitem(last=False)
+            total -= index.memory_size()
+            evicted.append(key)
+
+        self.evictions += len(evicted)
+        metrics.SNAPSHOT_EVICTIONS.inc(len(evicted))
+        metrics.SNAPSHOT_MEMORY.set(total)
+
+        return evicted
+
+    def delete(self, key):
+        """Drops the snapshot if it is stored"""
+        self.entries.pop(key, None)
+
+    def memory_size(self):
+        """Returns estimated memory footprint of all snapshots in bytes"""
+        return sum(index.memory_size() for index in self.entries.values())
+
+    def items(self):
+        return self.entries.items()
+
+    def values(self):
+        return self.entries.values()
+
+    def clear(self):
+        """Drops all snapshots"""
+        self.entries.clear()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
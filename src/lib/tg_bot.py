@@ -1,13 +1,35 @@
+import asyncio
+import html
 import json
-
-from lib.options import Options
+import os
+import signal
+import time
+
+from lib import metrics
+from lib.async_options import AsyncOptions
+from lib.csv_reader import CsvReader
+from lib.data_source import DataSource, DataSourceRouter
 from lib.gspread_reader import GspreadReader
+from lib.local_cache import LocalCache
+from lib.redis import Redis
+from lib.snapshot_cache import SnapshotCache
+from lib.snapshot_disk import DiskSnapshotStore
+from lib.update_processor import FairUpdateProcessor
+from lib.webhook_server import WebhookServer
 import logging
 import json
 from typing import Optional
 
-from telegram import Chat, ChatMember, ChatMemberUpdated, Update
-from telegram.constants import ParseMode
+from telegram import (
+    Chat,
+    ChatMember,
+    ChatMemberUpdated,
+    InlineQueryResultArticle,
+    InlineQueryResultsButton,
+    InputTextMessageContent,
+    Update,
+)
+from telegram.constants import MessageLimit, ParseMode
 from telegram.constants import ChatMemberStatus
 
 from telegram.ext import (
@@ -15,26 +37,53 @@ from telegram.ext import (
     ChatMemberHandler,
     CommandHandler,
     ContextTypes,
+    InlineQueryHandler,
 )
 
 class TgBot:
     token = ''
+    config = {}
     app = None
     logger = None
     options = None
+    background_tasks = []
+    source_configs = None
+    member_statuses = None
+    replies = None
+    ready = None
+    max_batch_keys = 100
+    # Longer headers are cut and longer cell values split into several lines: a line of both, escaped, fits a message
+    max_line_length = 400
+    find_limit = 10
+    # Telegram shows at most 50 inline results
+    inline_limit = 20
+    inline_cache_time = 30
+    inline_debounce = 0.3
+    # user id -> id of the latest inline query, earlier ones are superseded while the user types
+    inline_pending = {}
 
     commands = {
         'get_source': {'args': [], 'description': 'Показать мой текущий источник'},
         'set_source': {'args': ['source name'], 'description': 'Установить мой источник'},
-        'i': {'args': ['key'], 'description': 'Найти строку и вывести выбранные столбцы'},
-        'cfg_set_source': {'args': ['source name', 'source url', 'sheet_number', 'seek column', 'return columns'],
+        'i': {'args': ['key'], 'description': 'Найти строку и вывести выбранные столбцы (можно несколько ключей через пробел или с новой строки, составной ключ — значения подряд через пробел)'},
+        'find': {'args': ['key prefix'], 'description': 'Найти ключи, начинающиеся с указанного текста (без учёта регистра, пробелов и ведущих нулей)'},
+        'cfg_set_source': {'args': ['source name', 'source url', 'sheet_number', 'seek columns', 'return columns', 'ttl=seconds'],
                            'description': 'Добавить/обновить источник данных'},
         'cfg_get_source': {'args': ['source name'], 'description': 'Показать конфигурацию источника'},
+        'cfg_del_source': {'args': ['source name'], 'description': 'Удалить источник данных'},
+        'cfg_list_sources': {'args': [], 'description': 'Показать список источников'},
         'start':            {'args': [], 'description': 'Показать приветствие'},
         'help':             {'args': [], 'description': 'Показать справку'},
     }
 
-    def __init__(self, token, config):
+    def __init__(self, token, config, gspread_client=None, redis_client=None):
+        """
+        Args:
+            token: Telegram bot token
+            config: runtime parameters from main.py
+            gspread_client: gspread.Client to use instead of the service account from gsa_file
+            redis_client: redis.asyncio.Redis compatible client for options instead of the connection pool
+        """
         logging.basicConfig(
             format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
         )
@@ -44,80 +93,326 @@ class TgBot:
         self.logger = logging.getLogger(__name__)
 
         self.token = token
-        self.app = Application.builder().token(token).build()
+        self.config = config
+        self.find_limit = int(config.get('find_limit') or self.find_limit)
+        self.ready = asyncio.Event()
+        self.inline_pending = {}
+        self.inline_cache_time = int(config.get('inline_cache_time') or self.inline_cache_time)
+        self.inline_debounce = float(config.get('inline_debounce') or self.inline_debounce)
+        self.app = (Application.builder().token(token)
+                    .request(metrics.InstrumentedRequest(connection_pool_size=256))
+                    .concurrent_updates(FairUpdateProcessor(int(config.get('concurrent_updates') or 8)))
+                    .post_init(self.on_startup)
+                    .post_shutdown(self.on_shutdown)
+                    .build())
 
         # Get Redis connection parameters from config
         redis_host = config.get('redis_host', 'localhost')
         redis_port = int(config.get('redis_port', 6379))
         redis_password = config.get('redis_password', None)
 
-        self.options = Options({
+        self.options = AsyncOptions({
             'current_source':              {'type': 'str', 'description': 'Current data source', 'is_global_entity': False, 'default': 'default'},
             'sources':                     {'type': 'dict', 'description': 'Data source name', 'is_global_entity': True},
-        }, redis_host=redis_host, redis_port=redis_port, redis_password=redis_password)
-
-        self.gspread = GspreadReader(config)
+        }, redis_host=redis_host, redis_port=redis_port, redis_password=redis_password,
+           redis_max_connections=int(config.get('redis_max_connections') or 20),
+           redis_timeout=float(config.get('redis_timeout') or 5),
+           cache_size=int(config.get('options_cache_size') or 1000),
+           cache_ttl=float(config.get('options_cache_ttl') or 60),
+           redis_client=redis_client)
+
+        # Decoded source configs by their stored JSON: content addressed, so entries never go stale
+        self.source_configs = LocalCache(max_size=int(config.get('options_cache_size') or 1000), ttl=3600,
+                                         name='source_config')
+
+        # Rendered rows by (source, key, snapshot version): a refreshed snapshot has a new version,
+        # so replies rendered from the old one are never served again and age out of the LRU
+        self.replies = LocalCache(max_size=int(config.get('reply_cache_size') or 10000), ttl=3600, name='reply')
+
+        # Chat member statuses by (chat id, user id), kept fresh by chat member updates between TTL expiries
+        self.member_statuses = LocalCache(max_size=int(config.get('options_cache_size') or 1000),
+                                          ttl=float(config.get('admin_cache_ttl') or 60), name='chat_member')
+
+        # Optional snapshot cache shared by all bot replicas through Redis
+        snapshot_cache = None
+        if str(config.get('snapshot_cache') or '').lower() in ('true', '1', 'yes', 'on'):
+            snapshot_cache = SnapshotCache(Redis(host=redis_host, port=redis_port, password=redis_password),
+                                           ttl=int(config.get('index_ttl') or 300),
+                                           lock_ttl=int(config.get('snapshot_lock_ttl') or 60))
+
+        # Optional snapshots on local disk, served right after a restart
+        disk_store = None
+        if config.get('snapshot_dir'):
+            disk_store = DiskSnapshotStore(os.path.join(config['snapshot_dir'], 'snapshots.sqlite3'))
+
+        self.gspread = GspreadReader(config, snapshot_cache, gspread_client, disk_store)
+        # The scheme of the source URL picks the backend: Google Sheets for https://, local exports for file://,
+        # snapshots of all backends share one memory budget
+        backends = [self.gspread]
+        if config.get('data_dir'):
+            backends.append(CsvReader(config, self.gspread.indexes))
+        self.data_sources = DataSourceRouter(backends)
 
     async def is_admin(self, update: Update, user_id) -> bool:
         """Checks if a user is an administrator in the current chat."""
         if not update.effective_chat:
             return False
 
-        member = await update.effective_chat.get_member(user_id)
+        cache_key = (update.effective_chat.id, user_id)
+        status = self.member_statuses.get(cache_key)
+        if status is None:
+            member = await update.effective_chat.get_member(user_id)
+            status = member.status
+            self.member_statuses.set(cache_key, status)
 
-        return member.status in [ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER]
+        return status in [ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER]
 
     async def cmd_i(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         user = update.effective_message.from_user
 
         try:
             if len(context.args) < 1:
-                await update.effective_chat.send_message('Использование: /i <ключ>')
+                await update.effective_chat.send_message('Использование: /i <ключ> [<ключ> ...]')
                 return
-            key = context.args[0]
-            
-            source_name = self.options.get_option(user.id, 'current_source')
-            source_options = json.loads(self.options.get_option(user.id, 'sources', source_name))
 
-            if source_options == {}:
-                await update.effective_chat.send_message('Конфигурация источника не найдена')
+            source = await self.get_lookup_source(update, user.id)
+            if source is None:
                 return
-
-            # Validate required fields
-            missing = [f for f in ['url', 'seek', 'columns'] if f not in source_options or source_options[f] in [None, '']]
-            if missing:
-                await update.effective_chat.send_message('Источник настроен некорректно: отсутствует(ют) ' + ", ".join(missing))
+            url, seek, columns, sheet_idx, ttl = source
+
+            # Keys may be separated by spaces or newlines, repeated keys are looked up once
+            if len(seek) > 1:
+                # Composite key: consecutive arguments make up one key, e.g. /i A 123 B 456 for two seek columns
+                if len(context.args) % len(seek) != 0:
+                    await update.effective_chat.send_message(
+                        f'Ключ источника состоит из {len(seek)} значений: /i <{"> <".join(["значение"] * len(seek))}> [...]')
+                    return
+                keys = list(dict.fromkeys(tuple(context.args[i:i + len(seek)])
+                                          for i in range(0, len(context.args), len(seek))))
+            else:
+                keys = list(dict.fromkeys(context.args))
+            if len(keys) > self.max_batch_keys:
+                await update.effective_chat.send_message(f'Можно запросить не более {self.max_batch_keys} ключей за раз')
                 return
 
-            url = source_options['url']
-            seek = source_options['seek']
-            columns = [c.strip() for c in str(source_options['columns']).split(',') if c.strip()]
-            sheet_idx = int(source_options['sheet'])
+            rendered = await self.render_rows(url, keys, seek, columns, sheet_idx, ttl)
 
-            info = await self.gspread.get_info(url, key, seek, columns, sheet_idx)
+            if len(keys) == 1:
+                if not rendered[0]:
+                    await update.effective_chat.send_message('Значение не найдено')
+                    return
 
-            if not info or info == {}:
-                await update.effective_chat.send_message('Значение не найдено')
+                # Форматирование ответа: заголовок и выравненные колонки
+                title = f'<b>Результат для ключа</b> <code>{html.escape(self.format_key(keys[0]))}</code> (лист {sheet_idx})\n'
+                for page in self.paginate([title + rendered[0]]):
+                    await update.effective_chat.send_message(page, parse_mode=ParseMode.HTML)
                 return
 
-            # Форматирование ответа: заголовок и выравненные колонки
-            title = f'<b>Результат для ключа</b> <code>{key}</code> (лист {sheet_idx})\n'
-            max_header = max((len(h) for h in info.keys()), default=0)
-            lines = []
-            for h, v in info.items():
-                pad = ' ' * (max_header - len(h))
-                lines.append(f'<code>{h}{pad}</code> : <b>{v}</b>')
-            await update.effective_chat.send_message(title + "\n".join(lines), parse_mode=ParseMode.HTML)
+            found = sum(1 for info in rendered if info)
+            blocks = [f'<b>Результаты для {len(keys)} ключей</b> (лист {sheet_idx}), найдено: {found}\n']
+            for key, info in zip(keys, rendered):
+                if info:
+                    blocks.append(f'<b>Ключ</b> <code>{html.escape(self.format_key(key))}</code>\n' + info + '\n')
+                else:
+                    blocks.append(f'<b>Ключ</b> <code>{html.escape(self.format_key(key))}</code>: значение не найдено\n')
+
+            for page in self.paginate(blocks):
+                await update.effective_chat.send_message(page, parse_mode=ParseMode.HTML)
             return
         except Exception as e:
             await update.effective_chat.send_message(f'Ошибка при получении данных: {str(e)}')
 
+    async def render_rows(self, url, keys, seek, columns, sheet_idx, ttl) -> list:
+        """Returns formatted rows of the keys, '' for keys that are not found.
+
+        Rows already rendered from the current snapshot come from the cache, without a lookup.
+        """
+        snapshot = await self.data_sources.get_snapshot(url, seek, columns, sheet_idx, ttl)
+        source_key = (url, sheet_idx, tuple(seek), tuple(columns))
+        rendered = [self.replies.get((source_key, key, snapshot.version)) for key in keys]
+
+        missing = [key for key, reply in zip(keys, rendered) if reply is None]
+        if missing:
+            infos = await self.data_sources.get_info_many(url, missing, seek, columns, sheet_idx, ttl, snapshot)
+            replies = {}
+            for key, info in zip(missing, infos):
+                replies[key] = self.format_info(info)
+                self.replies.set((source_key, key, snapshot.version), replies[key])
+            rendered = [replies[key] if reply is None else reply for key, reply in zip(keys, rendered)]
+
+        return rendered
+
+    async def cmd_find(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        user = update.effective_message.from_user
+
+        try:
+            source = await self.get_lookup_source(update, user.id)
+            if source is None:
+                return
+            url, seek, columns, sheet_idx, ttl = source
+
+            # With several seek columns the arguments are the leading parts of the composite key
+            prefix = tuple(context.args[:len(seek)]) if len(seek) > 1 else ' '.join(context.args)
+            matches = await self.data_sources.find(url, prefix, seek, columns, sheet_idx, self.find_limit, ttl)
+            if not matches:
+                await update.effective_chat.send_message('Совпадений не найдено')
+                return
+
+            blocks = [f'<b>Ключи, начинающиеся с</b> <code>{html.escape(self.format_key(prefix))}</code> '
+                      f'(лист {sheet_idx}), показано: {len(matches)}\n']
+            for key, info in matches:
+                blocks.append(f'<b>Ключ</b> <code>{html.escape(self.format_key(key))}</code>\n' + self.format_info(info) + '\n')
+
+            for page in self.paginate(blocks):
+                await update.effective_chat.send_message(page, parse_mode=ParseMode.HTML)
+        except Exception as e:
+            await update.effective_chat.send_message(f'Ошибка при получении данных: {str(e)}')
+
+    async def inline_query(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Answers @bot <key prefix> from the index of the user's current source"""
+        inline_query = update.inline_query
+        user_id = inline_query.from_user.id
+        query = inline_query.query.strip()
+
+        # Debounce: a query per keystroke arrives while the user types, only the one they pause on is answered.
+        # The handler runs non-blocking, so newer queries of the user get here during the pause.
+        self.inline_pending[user_id] = inline_query.id
+        await asyncio.sleep(self.inline_debounce)
+        if self.inline_pending.get(user_id) != inline_query.id:
+            return
+        del self.inline_pending[user_id]
+
+        metrics.COMMANDS.labels('inline').inc()
+        with metrics.HANDLERS_IN_FLIGHT.track_inprogress(), metrics.COMMAND_DURATION.labels('inline').time():
+            try:
+                source, error = await self.get_source_params(user_id)
+                if error:
+                    # Results are personal: the button leads to the bot chat to set the source up
+                    await inline_query.answer([], cache_time=0, is_personal=True,
+                                              button=InlineQueryResultsButton(error, start_parameter='help'))
+                    return
+
+                url, seek, columns, sheet_idx, ttl = source
+                parts = query.split()
+                if not parts:
+                    await inline_query.answer([], cache_time=self.inline_cache_time, is_personal=True)
+                    return
+
+                prefix = tuple(parts[:len(seek)]) if len(seek) > 1 else ' '.join(parts)
+                matches = await self.data_sources.find(url, prefix, seek, columns, sheet_idx, self.inline_limit, ttl)
+
+                results = []
+                for number, (key, info) in enumerate(matches):
+                    title = f'<b>Ключ</b> <code>{html.escape(self.format_key(key))}</code> (лист {sheet_idx})\n'
+                    results.append(InlineQueryResultArticle(
+                        id=str(number),
+                        title=self.format_key(key),
+                        description=', '.join(f'{h}: {v}' for h, v in info.items())[:200],
+                        # Escaped like /i replies, a row longer than one message is cut at its first page
+                        input_message_content=InputTextMessageContent(
+                            self.paginate([title + self.format_info(info)])[0], parse_mode=ParseMode.HTML),
+                    ))
+
+                await inline_query.answer(results, cache_time=self.inline_cache_time, is_personal=True)
+            except Exception as e:
+                self.logger.warning('Inline query "%s" failed: %s', query, e)
+
+    async def get_lookup_source(self, update: Update, user_id) -> Optional[tuple]:
+        """Returns (url, seek columns, columns, sheet, ttl) of the user's current source, None after telling the user what is wrong"""
+        source, error = await self.get_source_params(user_id)
+        if error:
+            await update.effective_chat.send_message(error)
+
+        return source
+
+    async def get_source_params(self, user_id) -> tuple:
+        """Returns ((url, seek columns, columns, sheet, ttl), None) of the user's current source or (None, error message)"""
+        source_name, source_options = await self.get_current_source(user_id)
+
+        if source_options == {}:
+            return None, 'Конфигурация источника не найдена'
+
+        # Validate required fields
+        missing = [f for f in ['url', 'seek', 'columns'] if f not in source_options or source_options[f] in [None, '']]
+        if missing:
+            return None, 'Источник настроен некорректно: отсутствует(ют) ' + ", ".join(missing)
+
+        seek = [c.strip() for c in str(source_options['seek']).split(',') if c.strip()]
+        columns = [c.strip() for c in str(source_options['columns']).split(',') if c.strip()]
+
+        ttl = source_options.get('ttl')
+
+        return (source_options['url'], seek, columns, int(source_options['sheet']),
+                None if ttl in (None, '') else int(ttl)), None
+
+    async def get_current_source(self, user_id) -> tuple:
+        """Returns current source name of the user and its decoded config, {} if the source is not configured"""
+        source_name, source_json = await self.options.resolve_option(user_id, 'current_source', 'sources')
+        if not isinstance(source_json, str) or source_json == '':
+            return source_name, {}
+
+        source_options = self.source_configs.get(source_json)
+        if source_options is None:
+            source_options = json.loads(source_json)
+            self.source_configs.set(source_json, source_options)
+
+        return source_name, source_options
+
+    def format_key(self, key) -> str:
+        """Formats a key for display, parts of a composite key are separated by spaces"""
+        return ' '.join(key) if isinstance(key, tuple) else str(key)
+
+    def format_info(self, info) -> str:
+        """Formats found row as HTML lines of aligned headers and values.
+
+        Cell text is escaped, a value with line breaks or over max_line_length characters takes several lines,
+        each of them valid HTML on its own, so paginate may split the row between them.
+        """
+        headers = {h: str(h)[:self.max_line_length] for h in info.keys()}
+        max_header = max((len(h) for h in headers.values()), default=0)
+        lines = []
+        for h, v in info.items():
+            pad = ' ' * (max_header - len(headers[h]))
+            parts = [line[start:start + self.max_line_length]
+                     for line in str(v).split('\n') for start in range(0, max(len(line), 1), self.max_line_length)]
+            lines.append(f'<code>{html.escape(headers[h], quote=False)}{pad}</code> : '
+                         f'<b>{html.escape(parts[0], quote=False)}</b>')
+            lines.extend(f'<b>{html.escape(part, quote=False)}</b>' for part in parts[1:])
+
+        return "\n".join(lines)
+
+    def paginate(self, blocks, limit = MessageLimit.MAX_TEXT_LENGTH) -> list:
+        """Joins text blocks into as few messages as possible.
+
+        A block is kept in one message when it fits one, a longer one is split between its lines.
+        """
+        pages = []
+        page = ''
+        for block in blocks:
+            if len(block) > limit:
+                lines = block.split('\n')
+                parts = [line + '\n' for line in lines[:-1]] + ([lines[-1]] if lines[-1] else [])
+            else:
+                parts = [block]
+
+            for part in parts:
+                if page and len(page) + len(part) > limit:
+                    pages.append(page)
+                    page = ''
+
+                page += part
+
+        if page:
+            pages.append(page)
+
+        return pages
+
     async def cmd_cfg_get_source(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_message.from_user
         source_name = context.args[0]
 
         try:
-            source = self.options.get_option(user.id, 'sources', source_name)
+            source = await self.options.get_option(user.id, 'sources', source_name)
             await update.effective_chat.send_message(f'Конфигурация источника "{source_name}": {json.dumps(source)}')
         except Exception as e:
             await update.effective_chat.send_message(f'Ошибка при получении конфигурации: {str(e)}')
@@ -135,19 +430,55 @@ class TgBot:
             'seek': context.args[3],
             'columns': context.args[4]
         }
+        # Optional freshness budget of the source data, INDEX_TTL otherwise
+        if len(context.args) > 5:
+            source_params['ttl'] = context.args[5].split('=')[-1]
 
         try:
+            # Reject malformed column lists now rather than on every lookup
+            DataSource.parse_columns(source_params['seek'], source_params['columns'])
+            self.data_sources.check_location(source_params['url'])
+            if 'ttl' in source_params and not source_params['ttl'].isdigit():
+                raise Exception('Время актуальности данных (ttl) должно быть целым числом секунд')
+
             await update.effective_chat.send_message(f'Сохраняю источник {source_name}')
-            self.options.set_option(user.id, 'sources', json.dumps(source_params), source_name)
+            await self.options.set_option(user.id, 'sources', json.dumps(source_params), source_name)
         except Exception as e:
             await update.effective_chat.send_message(f'Ошибка при сохранении источника: {str(e)}')
 
+    async def cmd_cfg_del_source(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """ """
+        user = update.effective_message.from_user
+        source_name = context.args[0]
+
+        try:
+            if await self.options.delete_option(user.id, 'sources', source_name):
+                await update.effective_chat.send_message(f'Источник "{source_name}" удалён')
+            else:
+                await update.effective_chat.send_message(f'Источник не найден: {source_name}')
+        except Exception as e:
+            await update.effective_chat.send_message(f'Ошибка при удалении источника: {str(e)}')
+
+    async def cmd_cfg_list_sources(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """ """
+        user = update.effective_message.from_user
+
+        try:
+            sources = await self.options.get_option_items(user.id, 'sources')
+            if not sources:
+                await update.effective_chat.send_message('Источники не настроены')
+                return
+
+            await update.effective_chat.send_message('Источники: ' + ', '.join(sorted(sources)))
+        except Exception as e:
+            await update.effective_chat.send_message(f'Ошибка при получении списка источников: {str(e)}')
+
     async def cmd_get_source(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """ """
         user = update.effective_message.from_user
 
         try:
-            source_name = self.options.get_option(user.id, 'current_source')
+            source_name = await self.options.get_option(user.id, 'current_source')
             await update.effective_chat.send_message(f'Ваш текущий источник: "{source_name}"')
         except Exception as e:
             await update.effective_chat.send_message(f'Ошибка при получении имени источника: {str(e)}')
@@ -159,14 +490,14 @@ class TgBot:
         source_name = context.args[0]
 
         try:
-            source = self.options.get_option(user.id, 'sources', source_name)
+            source = await self.options.get_option(user.id, 'sources', source_name)
             if source == {}:
                 await update.effective_chat.send_message(f'Источник не найден: {source_name}')
 
                 return
 
             await update.effective_chat.send_message(f'Сменяю источник на "{source_name}"')
-            self.options.set_option(user.id, 'current_source', source_name)
+            await self.options.set_option(user.id, 'current_source', source_name)
         except Exception as e:
             await update.effective_chat.send_message(f'Ошибка при установке источника: {str(e)}')
 
@@ -245,6 +576,10 @@ class TgBot:
             return
         was_member, is_member = result
 
+        # Bot rights changed, chat member updates may have stopped or started: cached statuses can't be trusted
+        chat_id = update.my_chat_member.chat.id
+        self.member_statuses.delete_where(lambda key: key[0] == chat_id)
+
         # Let's check who is responsible for the change
         cause_name = update.effective_user.full_name
 
@@ -267,7 +602,7 @@ class TgBot:
                 context.bot_data.setdefault("group_ids", set()).add(chat.id)
             elif was_member and not is_member:
                 self.logger.info("%s removed the bot from the group %s", cause_name, chat.title)
-                context.bot_data.setdefaПокult("group_ids", set()).discard(chat.id)
+                context.bot_data.setdefault("group_ids", set()).discard(chat.id)
         elif not was_member and is_member:
             self.logger.info("%s added the bot to the channel %s", cause_name, chat.title)
             context.bot_data.setdefault("channel_ids", set()).add(chat.id)
@@ -275,6 +610,12 @@ class TgBot:
             self.logger.info("%s removed the bot from the channel %s", cause_name, chat.title)
             context.bot_data.setdefault("channel_ids", set()).discard(chat.id)
 
+    async def track_members(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Keeps cached chat member statuses in line with promotions, demotions and departures"""
+        chat_member = update.chat_member
+        self.member_statuses.set((chat_member.chat.id, chat_member.new_chat_member.user.id),
+                                 chat_member.new_chat_member.status)
+
     async def common_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Bot commands dispatcher"""
         user = update.effective_message.from_user
@@ -282,7 +623,8 @@ class TgBot:
         chat_id = update.effective_chat.id
         message_id = update.effective_message.id
 
-        command_with_bot_name = message_text.split(' ')[0]
+        # Arguments may follow the command on the next line, so split on any whitespace
+        command_with_bot_name = message_text.split()[0]
         command_name = command_with_bot_name.split('@')[0][1:]
 
         if command_name not in self.commands:
@@ -313,7 +655,9 @@ class TgBot:
         if not handler:
             await update.effective_chat.send_message(f'Нет обработчика для команды {command_name}')
 
-        await handler(update, context)
+        metrics.COMMANDS.labels(command_name).inc()
+        with metrics.HANDLERS_IN_FLIGHT.track_inprogress(), metrics.COMMAND_DURATION.labels(command_name).time():
+            await handler(update, context)
 
         return
 
@@ -324,10 +668,122 @@ class TgBot:
 
         # Handle chat join request
         self.app.add_handler(ChatMemberHandler(self.track_chats, ChatMemberHandler.MY_CHAT_MEMBER))
+        # Inline mode must be enabled with BotFather, queries of one user run concurrently for the debounce to work
+        self.app.add_handler(InlineQueryHandler(self.inline_query, block=False))
+
+        # Role changes of other members, delivered while the bot is a chat administrator
+        self.app.add_handler(ChatMemberHandler(self.track_members, ChatMemberHandler.CHAT_MEMBER))
+
+        if int(self.config.get('metrics_port') or 0):
+            metrics.start_server(self.config['metrics_port'])
+            self.logger.info('Serving metrics on port %s', self.config['metrics_port'])
+
+        if self.config.get('mode') == 'webhook':
+            asyncio.run(self.run_webhook())
+        else:
+            self.app.run_polling(allowed_updates=Update.ALL_TYPES)
+
+    async def run_webhook(self) -> None:
+        """Serve updates posted by Telegram to the local HTTP server until SIGINT or SIGTERM.
+
+        Any number of workers may run behind a load balancer: only those given webhook_url register it with Telegram.
+        """
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+
+        secret_token = self.config.get('webhook_secret') or None
+        server = WebhookServer(self.app, self.config.get('webhook_path') or '/telegram', secret_token)
+
+        async with self.app:
+            await self.on_startup(self.app)
+            try:
+                if self.config.get('webhook_url'):
+                    await self.app.bot.set_webhook(url=self.config['webhook_url'], secret_token=secret_token,
+                                                   allowed_updates=Update.ALL_TYPES)
+
+                listen = self.config.get('webhook_listen') or '0.0.0.0'
+                port = int(self.config.get('webhook_port') or 8443)
+                server.start(listen, port)
+                await self.app.start()
+                self.logger.info('Listening for webhook updates on %s:%s', listen, port)
+
+                await stop_event.wait()
+            finally:
+                await server.stop()
+                if self.app.running:
+                    await self.app.stop()
+                await self.on_shutdown(self.app)
+
+    async def on_startup(self, app: Application) -> None:
+        """Check storage before accepting updates and start background tasks"""
+        await self.options.redis.ping()
+        await self.options.migrate_dict_options()
+
+        self.background_tasks = [asyncio.create_task(self.options.listen_invalidations()),
+                                 asyncio.create_task(self.data_sources.refresh_loop(min(30, self.gspread.index_ttl / 4 or 1)))]
+
+        # Updates are served while worksheets load, a lookup of a source being loaded joins its load
+        if str(self.config.get('warmup', 'true')).lower() in ('true', '1', 'yes', 'on'):
+            self.background_tasks.append(asyncio.create_task(self.warm_up()))
+        else:
+            self.set_ready()
+
+    async def warm_up(self) -> None:
+        """Preload worksheets of all configured sources, a few at a time, then report readiness"""
+        start = time.monotonic()
+        sources = {}
+        try:
+            for source_name, source_json in (await self.options.get_option_items(None, 'sources')).items():
+                try:
+                    source_options = json.loads(source_json)
+                    seek = source_options['seek']
+                    columns = [c.strip() for c in str(source_options['columns']).split(',') if c.strip()]
+                    # Sources of different users often point to the same worksheet, it is loaded once
+                    sources.setdefault((source_options['url'], int(source_options['sheet']), str(seek),
+                                        ','.join(columns), source_options.get('ttl') or None), source_name)
+                except Exception as e:
+                    self.logger.warning('Warm-up: skipping source "%s": %s', source_name, e)
+        except Exception as e:
+            self.logger.warning('Warm-up: failed to list sources: %s', e)
+
+        semaphore = asyncio.Semaphore(int(self.config.get('warmup_concurrency') or 2))
+
+        async def preload(url, sheet_idx, seek, columns, ttl, source_name):
+            async with semaphore:
+                try:
+                    rows = await self.data_sources.preload(url, seek, columns, sheet_idx, ttl)
+                    metrics.WARMUP_SOURCES.labels('loaded').inc()
+                    self.logger.info('Warm-up: source "%s" loaded, %d rows', source_name, rows)
+
+                    return True
+                except Exception as e:
+                    metrics.WARMUP_SOURCES.labels('failed').inc()
+                    self.logger.warning('Warm-up: source "%s" failed to load: %s', source_name, e)
+
+                    return False
+
+        results = await asyncio.gather(*(preload(*key, source_name) for key, source_name in sources.items()))
+        self.logger.info('Warm-up finished in %.1f s: %d of %d worksheets loaded',
+                         time.monotonic() - start, sum(results), len(results))
+        self.set_ready()
+
+    def set_ready(self) -> None:
+        """Report that the bot serves lookups from memory"""
+        self.ready.set()
+        metrics.WARMUP_READY.set(1)
+
+    async def on_shutdown(self, app: Application) -> None:
+        """Stop background tasks and close Redis connections while the event loop is still running"""
+        for task in self.background_tasks:
+            task.cancel()
+        await asyncio.gather(*self.background_tasks, return_exceptions=True)
 
-        self.app.run_polling(allowed_updates=Update.ALL_TYPES)
+        if self.options:
+            await self.options.close()
 
     def stop(self):
-        """Stop the bot and close Redis connection"""
-        if hasattr(self, 'options') and self.options:
-            self.options.close()
\ No newline at end of file
+        """Stop workers of all data source backends"""
+        if hasattr(self, 'data_sources') and self.data_sources:
+            self.data_sources.close()
\ No newline at end of file
@@ -0,0 +1,109 @@
+"""
+Update processor: handles updates of different chats concurrently, keeps the order within a chat
+and takes turns between chats, so one busy chat can't hold up everybody else
+"""
+import asyncio
+from collections import deque
+
+from telegram.ext import BaseUpdateProcessor
+
+
+class FairUpdateProcessor(BaseUpdateProcessor):
+    # Updates accepted from the application at once: the base class semaphore then only limits admission,
+    # the actual concurrency is decided by our own scheduler
+    max_pending_updates = 1024
+
+    def __init__(self, max_concurrent_updates, max_pending_updates=None):
+        """
+        Args:
+            max_concurrent_updates: updates processed at the same time, each of a different chat
+            max_pending_updates: updates waiting for their turn before the application is held back
+        """
+        super().__init__(max(max_pending_updates or self.max_pending_updates, max_concurrent_updates))
+        if max_concurrent_updates < 1:
+            raise ValueError('max_concurrent_updates must be a positive integer')
+
+        self.concurrency = max_concurrent_updates
+        self.running = 0
+        # chat key -> turns of its waiting updates, in arrival order
+        self.queues = {}
+        # Chats with waiting updates and nothing running, the first one gets the next free slot
+        self.ready = deque()
+        self.active_chats = set()
+
+    @staticmethod
+    def get_chat_key(update):
+        """Returns the key updates are ordered and scheduled by: chat, then user, otherwise the update itself"""
+        chat = getattr(update, 'effective_chat', None)
+        if chat is not None:
+            return 'chat', chat.id
+
+        user = getattr(update, 'effective_user', None)
+        if user is not None:
+            return 'user', user.id
+
+        return 'update', id(update)
+
+    async def do_process_update(self, update, coroutine):
+        key = self.get_chat_key(update)
+        turn = asyncio.get_running_loop().create_future()
+
+        queue = self.queues.setdefault(key, deque())
+        queue.append(turn)
+        if len(queue) == 1 and key not in self.active_chats:
+            self.ready.append(key)
+        self.dispatch()
+
+        try:
+            await turn
+        except asyncio.CancelledError:
+            if turn.done() and not turn.cancelled():
+                # The slot was already given to us
+                self.release(key)
+            else:
+                self.forget(key, turn)
+            coroutine.close()
+            raise
+
+        try:
+            await coroutine
+        finally:
+            self.release(key)
+
+    def dispatch(self):
+        """Give free slots to ready chats in round-robin order"""
+        while self.running < self.concurrency and self.ready:
+            key = self.ready.popleft()
+            turn = self.queues[key].popleft()
+            if not self.queues[key]:
+                del self.queues[key]
+
+            self.active_chats.add(key)
+            self.running += 1
+            turn.set_result(None)
+
+    def release(self, key):
+        """Free the slot of the chat update, the chat goes to the back of the line if it has more updates"""
+        self.running -= 1
+        self.active_chats.discard(key)
+        if key in self.queues:
+            self.ready.append(key)
+        self.dispatch()
+
+    def forget(self, key, turn):
+        """Drop a waiting update that was cancelled before its turn"""
+        queue = self.queues.get(key)
+        if queue is None:
+            return
+
+        queue.remove(turn)
+        if not queue:
+            del self.queues[key]
+            if key in self.ready:
+                self.ready.remove(key)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,86 @@
+"""
+Webhook server: receives Telegram updates over HTTP and passes them to the bot application update queue
+"""
+import hmac
+import json
+import logging
+
+import tornado.httpserver
+import tornado.web
+from telegram import Update
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class UpdateHandler(tornado.web.RequestHandler):
+    """Accepts update JSON posted by Telegram"""
+
+    def initialize(self, bot_application, secret_token):
+        self.bot_application = bot_application
+        self.secret_token = secret_token
+
+    async def post(self):
+        if self.secret_token:
+            # Constant time comparison, the token is the only thing that tells Telegram from anybody else
+            token = self.request.headers.get(SECRET_TOKEN_HEADER, '')
+            if not hmac.compare_digest(token.encode(), self.secret_token.encode()):
+                raise tornado.web.HTTPError(403)
+
+        try:
+            data = json.loads(self.request.body)
+            update = Update.de_json(data, self.bot_application.bot)
+        except Exception:
+            raise tornado.web.HTTPError(400)
+
+        if update is None:
+            raise tornado.web.HTTPError(400)
+
+        # Processing happens on the application side, Telegram only waits for the update to be queued
+        await self.bot_application.update_queue.put(update)
+        self.set_status(200)
+
+    def log_exception(self, typ, value, tb):
+        if isinstance(value, tornado.web.HTTPError):
+            logging.getLogger(__name__).warning('Webhook request rejected: %s', value)
+        else:
+            super().log_exception(typ, value, tb)
+
+
+class HealthHandler(tornado.web.RequestHandler):
+    """Liveness probe for load balancers"""
+
+    def get(self):
+        self.write('ok')
+
+
+class WebhookServer:
+    application = None
+    server = None
+
+    def __init__(self, application, url_path='/telegram', secret_token=None):
+        """
+        Args:
+            application: telegram.ext.Application whose update_queue receives the updates
+            url_path: path Telegram posts updates to
+            secret_token: value expected in the X-Telegram-Bot-Api-Secret-Token header, None disables the check
+        """
+        self.application = application
+        if not url_path.startswith('/'):
+            url_path = '/' + url_path
+
+        self.web_app = tornado.web.Application([
+            (url_path, UpdateHandler, {'bot_application': application, 'secret_token': secret_token}),
+            ('/healthz', HealthHandler),
+        ])
+
+    def start(self, listen='0.0.0.0', port=8443):
+        """Start listening, must be called from a running event loop"""
+        self.server = tornado.httpserver.HTTPServer(self.web_app, xheaders=True)
+        self.server.listen(int(port), address=listen)
+
+    async def stop(self):
+        """Stop accepting requests and close open connections"""
+        if self.server:
+            self.server.stop()
+            await self.server.close_all_connections()
+            self.server = None
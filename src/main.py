@@ -9,14 +9,48 @@ def main() -> None:
     parser.add_argument('--redis_host', action=EnvDefault, envvar='REDIS_HOST', help='Redis server host name')
     parser.add_argument('--redis_port', action=EnvDefault, envvar='REDIS_PORT', help='Redis server port number')
     parser.add_argument('--redis_password', action=EnvDefault, envvar='REDIS_PASSWORD', help='Redis server password')
+    parser.add_argument('--redis_max_connections', action=EnvDefault, envvar='REDIS_MAX_CONNECTIONS', default=20, help='Redis connection pool size')
+    parser.add_argument('--redis_timeout', action=EnvDefault, envvar='REDIS_TIMEOUT', default=5, help='Redis connect, reply and pool wait timeout in seconds')
+    parser.add_argument('--options_cache_size', action=EnvDefault, envvar='OPTIONS_CACHE_SIZE', default=1000, help='Max number of option values cached in memory')
+    parser.add_argument('--options_cache_ttl', action=EnvDefault, envvar='OPTIONS_CACHE_TTL', default=60, help='Seconds an option value is cached in memory')
     parser.add_argument('-gsa', '--gsa_file',            action=EnvDefault, envvar='GSA_FILE',       help='Path to google service account file')
+    parser.add_argument('--index_ttl', action=EnvDefault, envvar='INDEX_TTL', default=300, help='Seconds before the worksheet lookup index is rebuilt')
+    parser.add_argument('--index_max_age', action=EnvDefault, envvar='INDEX_MAX_AGE', default=3600, help='Seconds a stale worksheet index may still be served while it refreshes in the background')
+    parser.add_argument('--snapshot_memory_mb', action=EnvDefault, envvar='SNAPSHOT_MEMORY_MB', default=256, help='Memory budget of worksheet snapshots in MB, least recently used ones are evicted')
+    parser.add_argument('--gspread_workers', action=EnvDefault, envvar='GSPREAD_WORKERS', default=4, help='Max concurrent Google Sheets requests')
+    parser.add_argument('--gspread_background_workers', action=EnvDefault, envvar='GSPREAD_BACKGROUND_WORKERS', default=0, help='Max Google Sheets workers background refreshes and preloading may hold, 0 for half of GSPREAD_WORKERS')
+    parser.add_argument('--google_reads_per_minute', action=EnvDefault, envvar='GOOGLE_READS_PER_MINUTE', default=60, help='Google Sheets API calls per minute this process may make, 0 for no limit')
+    parser.add_argument('--google_burst', action=EnvDefault, envvar='GOOGLE_BURST', default=10, help='Google Sheets API calls allowed at once after a quiet period')
+    parser.add_argument('--google_max_retries', action=EnvDefault, envvar='GOOGLE_MAX_RETRIES', default=5, help='Retries of Google Sheets API calls answered with 429 or 5xx')
+    parser.add_argument('--snapshot_dir', action=EnvDefault, envvar='SNAPSHOT_DIR', default='', help='Directory to keep worksheet snapshots in across restarts, empty disables it')
+    parser.add_argument('--data_dir', action=EnvDefault, envvar='DATA_DIR', default='', help='Directory of local CSV/TSV sources served by file:// URLs, empty disables them')
+    parser.add_argument('--snapshot_cache', action=EnvDefault, envvar='SNAPSHOT_CACHE', default='', help='Share worksheet snapshots between replicas through Redis (true/false)')
+    parser.add_argument('--snapshot_lock_ttl', action=EnvDefault, envvar='SNAPSHOT_LOCK_TTL', default=60, help='Seconds one replica may hold the snapshot refresh lock')
+    parser.add_argument('--warmup', action=EnvDefault, envvar='WARMUP', default='true', help='Preload worksheets of all configured sources at startup (true/false)')
+    parser.add_argument('--warmup_concurrency', action=EnvDefault, envvar='WARMUP_CONCURRENCY', default=2, help='Max worksheets preloaded at the same time')
+    parser.add_argument('--mode', action=EnvDefault, envvar='BOT_MODE', default='polling', choices=['polling', 'webhook'], help='How to receive updates from Telegram')
+    parser.add_argument('--webhook_listen', action=EnvDefault, envvar='WEBHOOK_LISTEN', default='0.0.0.0', help='Webhook server listen address')
+    parser.add_argument('--webhook_port', action=EnvDefault, envvar='WEBHOOK_PORT', default=8443, help='Webhook server port')
+    parser.add_argument('--webhook_path', action=EnvDefault, envvar='WEBHOOK_PATH', default='/telegram', help='URL path Telegram posts updates to')
+    parser.add_argument('--webhook_url', action=EnvDefault, envvar='WEBHOOK_URL', help='Public webhook URL to register with Telegram, leave empty on extra workers')
+    parser.add_argument('--webhook_secret', action=EnvDefault, envvar='WEBHOOK_SECRET', help='Secret token Telegram must send with every update')
+    parser.add_argument('--reply_cache_size', action=EnvDefault, envvar='REPLY_CACHE_SIZE', default=10000, help='Max number of rendered /i rows cached in memory')
+    parser.add_argument('--find_limit', action=EnvDefault, envvar='FIND_LIMIT', default=10, help='Max number of rows /find returns')
+    parser.add_argument('--inline_cache_time', action=EnvDefault, envvar='INLINE_CACHE_TIME', default=30, help='Seconds Telegram caches inline query results of a user')
+    parser.add_argument('--inline_debounce', action=EnvDefault, envvar='INLINE_DEBOUNCE', default=0.3, help='Seconds to wait for the user to stop typing before answering an inline query')
+    parser.add_argument('--admin_cache_ttl', action=EnvDefault, envvar='ADMIN_CACHE_TTL', default=60, help='Seconds a chat member status is cached for admin checks')
+    parser.add_argument('--concurrent_updates', action=EnvDefault, envvar='CONCURRENT_UPDATES', default=8, help='Max number of updates of different chats processed at once')
+    parser.add_argument('--metrics_port', action=EnvDefault, envvar='METRICS_PORT', default=0, help='Port of the Prometheus /metrics endpoint, 0 disables it')
     parser.add_argument('-tg_token', '--telegram_token', action=EnvDefault, envvar='TELEGRAM_TOKEN', help='Telegram token', required=True)
 
     args = parser.parse_args()
     config = vars(args)
 
     bot = TgBot(config['telegram_token'], config)
-    bot.run()
+    try:
+        bot.run()
+    finally:
+        bot.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
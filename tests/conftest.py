@@ -0,0 +1,24 @@
+"""
+Shared fixtures: a bot wired to a generated worksheet and fakeredis.
+Modules override the worksheet or bot_config fixtures to change what the bot is built with.
+"""
+import pytest
+
+from fakes import FakeWorksheet, make_bot
+
+
+@pytest.fixture
+def worksheet():
+    return FakeWorksheet(30, 3)
+
+
+@pytest.fixture
+def bot_config():
+    return {}
+
+
+@pytest.fixture
+def bot(worksheet, bot_config):
+    bot = make_bot(worksheet, bot_config)
+    yield bot
+    bot.stop()
@@ -0,0 +1,118 @@
+"""
+Local stand-ins for Google Sheets and Telegram shared by the tests and the benchmarks: a generated worksheet,
+a gspread client serving it, minimal updates, a bot wired to them and to fakeredis, and a markup check of HTML replies
+"""
+import os
+import sys
+import types
+from html.parser import HTMLParser
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+import fakeredis
+from gspread.exceptions import APIError
+from gspread.utils import a1_to_rowcol
+from telegram.constants import MessageLimit
+
+from lib.tg_bot import TgBot
+
+
+class FakeWorksheet:
+    """Worksheet of generated rows: keys K0000001... in the first column, cell values elsewhere"""
+
+    def __init__(self, rows, columns):
+        self.values = [[f'Header {col}' for col in range(1, columns + 1)]]
+        for row in range(1, rows + 1):
+            self.values.append([f'K{row:07d}'] + [f'r{row}c{col}' for col in range(2, columns + 1)])
+
+    @property
+    def col_count(self):
+        return len(self.values[0])
+
+    def batch_get(self, ranges, major_dimension='ROWS'):
+        # Same shape as the Sheets API: one value range per requested range, each a list of columns
+        result = []
+        for value_range in ranges:
+            col = a1_to_rowcol(value_range.split(':')[0] + '1')[1]
+            if col > self.col_count:
+                raise APIError(types.SimpleNamespace(text='', json=lambda: {'error': {
+                    'code': 400, 'message': f'Range ({value_range}) exceeds grid limits', 'status': 'INVALID_ARGUMENT'}}))
+            result.append([[row[col - 1] for row in self.values]])
+
+        return result
+
+    def get_all_values(self):
+        return self.values
+
+
+class FakeSpreadsheet:
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+
+    def get_worksheet(self, index):
+        return self.worksheet if index == 0 else None
+
+
+class FakeClient:
+    """Stand-in for gspread.Client that serves one worksheet for every URL"""
+
+    def __init__(self, worksheet):
+        self.spreadsheet = FakeSpreadsheet(worksheet)
+
+    def open_by_url(self, url):
+        return self.spreadsheet
+
+
+class FakeChat:
+    id = 1
+
+    def __init__(self):
+        self.messages = []
+
+    async def send_message(self, text, **kwargs):
+        self.messages.append(text)
+
+
+def make_update(text, user_id=1):
+    """Minimal update and context objects for TgBot.common_handler"""
+    user = types.SimpleNamespace(id=user_id, full_name='Test user')
+    message = types.SimpleNamespace(text=text, from_user=user, id=1)
+    update = types.SimpleNamespace(effective_message=message, effective_chat=FakeChat(), effective_user=user)
+
+    return update, types.SimpleNamespace(args=text.split()[1:], bot_data={})
+
+
+def make_bot(worksheet, config=None):
+    """TgBot reading the worksheet for every source URL, options stored in fakeredis"""
+    return TgBot('0:test', dict(config or {}), gspread_client=FakeClient(worksheet),
+                 redis_client=fakeredis.aioredis.FakeRedis(decode_responses=True))
+
+
+class TagChecker(HTMLParser):
+    """Collects the text of a message and fails on tags Telegram would reject"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.open_tags = []
+        self.text = ''
+
+    def handle_starttag(self, tag, attrs):
+        assert tag in ('b', 'code'), tag
+        self.open_tags.append(tag)
+
+    def handle_endtag(self, tag):
+        assert self.open_tags and self.open_tags.pop() == tag, tag
+
+    def handle_data(self, data):
+        self.text += data
+
+
+def message_text(message):
+    """Returns the text Telegram shows for an HTML message, checking the markup"""
+    assert len(message) <= MessageLimit.MAX_TEXT_LENGTH
+    checker = TagChecker()
+    checker.feed(message)
+    checker.close()
+    assert checker.open_tags == []
+
+    return checker.text
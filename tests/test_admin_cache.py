@@ -0,0 +1,40 @@
+"""
+Tests for the chat member status cache behind admin checks
+"""
+import sys
+import os
+import asyncio
+import types
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from telegram.constants import ChatMemberStatus
+
+
+class Chat:
+    id = 10
+
+    def __init__(self):
+        self.calls = 0
+
+    async def get_member(self, user_id):
+        self.calls += 1
+        return types.SimpleNamespace(status=ChatMemberStatus.ADMINISTRATOR)
+
+
+def test_member_status_is_fetched_once_and_updated_by_chat_member_updates(bot):
+    chat = Chat()
+    update = types.SimpleNamespace(effective_chat=chat)
+
+    async def scenario():
+        assert await bot.is_admin(update, 1)
+        assert await bot.is_admin(update, 1)
+        assert chat.calls == 1
+
+        demoted = types.SimpleNamespace(chat=chat, new_chat_member=types.SimpleNamespace(
+            user=types.SimpleNamespace(id=1), status=ChatMemberStatus.MEMBER))
+        await bot.track_members(types.SimpleNamespace(chat_member=demoted), None)
+
+        assert not await bot.is_admin(update, 1)
+        assert chat.calls == 1
+
+    asyncio.run(scenario())
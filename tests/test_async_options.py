@@ -0,0 +1,72 @@
+"""
+Tests for options stored through the asyncio Redis client, on fakeredis
+"""
+import asyncio
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+import fakeredis
+
+from lib.async_options import AsyncOptions
+from lib.options import Options
+
+SETUP = {
+    'enabled': {'type': 'bool', 'is_global_entity': False, 'default': True},
+    'limit': {'type': 'int', 'is_global_entity': False, 'default': 10},
+    'name': {'type': 'str', 'is_global_entity': True},
+    'sources': {'type': 'dict', 'is_global_entity': True},
+}
+
+
+def test_options_round_trip_and_defaults():
+    options = AsyncOptions(SETUP, redis_client=fakeredis.aioredis.FakeRedis(decode_responses=True))
+
+    async def scenario():
+        assert await options.get_option(1, 'enabled') is True
+        assert await options.get_option(1, 'limit') == 10
+        assert await options.get_option(1, 'name') == ''
+        assert await options.get_option(1, 'sources', 'default') == {}
+
+        await options.set_option(1, 'enabled', False)
+        await options.set_option(1, 'limit', '25')
+        await options.set_option(1, 'name', 'bot')
+        await options.set_option(1, 'sources', 'config', 'default')
+
+        assert await options.get_option(1, 'enabled') is False
+        assert await options.get_option(1, 'limit') == 25
+        assert await options.get_option(1, 'name') == 'bot'
+        assert await options.get_option(1, 'sources', 'default') == 'config'
+        assert await options.get_option_items(1, 'sources') == {'default': 'config'}
+
+        # Per-user options are stored per user, global ones are shared
+        assert await options.get_option(2, 'limit') == 10
+        assert await options.get_option(2, 'name') == 'bot'
+
+        assert await options.delete_option(1, 'limit') == 1
+        assert await options.get_option(1, 'limit') == 10
+
+    asyncio.run(scenario())
+
+
+def test_sync_and_async_options_share_the_stored_form():
+    server = fakeredis.FakeServer()
+    options = Options(SETUP, redis_client=fakeredis.FakeRedis(server=server, decode_responses=True))
+    async_options = AsyncOptions(SETUP, redis_client=fakeredis.aioredis.FakeRedis(server=server, decode_responses=True))
+    values = {'enabled': False, 'limit': 7, 'name': 'shared'}
+
+    async def scenario():
+        for option_name, value in values.items():
+            options.set_option(1, option_name, value)
+            assert await async_options.get_option(1, option_name) == value
+
+            await async_options.delete_option(1, option_name)
+            await async_options.set_option(1, option_name, value)
+            options.invalidate()
+            assert options.get_option(1, option_name) == value
+
+        await async_options.set_option(1, 'sources', 'config', 'default')
+        assert options.get_option(1, 'sources', 'default') == 'config'
+        assert options.get_option_items(1, 'sources') == await async_options.get_option_items(1, 'sources')
+
+    asyncio.run(scenario())
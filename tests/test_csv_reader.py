@@ -0,0 +1,163 @@
+"""
+Tests for local CSV/TSV sources and routing source URLs to backends
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from fakes import FakeClient, FakeWorksheet, make_bot
+from lib.csv_index import CsvIndex
+from lib.csv_reader import CsvReader
+from lib.data_source import DataSourceRouter
+from lib.gspread_reader import GspreadReader
+
+
+def write(path, text):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write(text)
+
+
+def test_index_keeps_offsets_and_parses_quoted_records():
+    with tempfile.TemporaryDirectory() as data_dir:
+        path = os.path.join(data_dir, 'export.csv')
+        write(path, '\ufeffid,name,city\r\n'
+                    'A1,"Smith, John",Moscow\r\n'
+                    '\r\n'
+                    'B2,"Multi\nline ""quoted""",Kazan\r\n'
+                    'A1,Duplicate,Omsk\r\n'
+                    'C3\r\n')
+        index = CsvIndex(path, 1)
+
+        assert index.headers == {1: 'id', 2: 'name', 3: 'city'}
+        assert len(index) == 3
+        assert index.get_value(index.lookup('A1'), 2) == 'Smith, John'
+        assert index.get_value(index.lookup('B2'), 2) == 'Multi\nline "quoted"'
+        assert index.get_value(index.lookup('B2'), 3) == 'Kazan'
+        assert index.get_value(index.lookup('C3'), 3) == ''
+        assert index.lookup('missing') is None
+        assert [index.get_key(row) for row in index.search('b')] == ['B2']
+        assert not index.is_modified()
+
+
+def test_reader_serves_files_from_data_dir_only():
+    with tempfile.TemporaryDirectory() as data_dir:
+        write(os.path.join(data_dir, 'stock.tsv'), 'sku\twarehouse\tqty\nX-1\tNorth\t5\nX-1\tSouth\t7\n')
+        reader = CsvReader({'data_dir': data_dir})
+
+        async def lookups():
+            assert await reader.get_info('file:stock.tsv', ('x-1', 'south'), '1,2', [3]) == {'Qty': '7'}
+            assert await reader.find('file:stock.tsv', ('X-1',), '1,2', [3]) == [
+                (('X-1', 'North'), {'Qty': '5'}), (('X-1', 'South'), {'Qty': '7'})]
+
+            for location in ('file:../outside.csv', 'file:///etc/passwd'):
+                try:
+                    await reader.get_info(location, 'root', 1, [2])
+                    assert False, 'Exception expected'
+                except Exception as e:
+                    assert 'каталоге данных' in str(e)
+
+        try:
+            asyncio.run(lookups())
+        finally:
+            reader.close()
+
+
+def test_changed_file_is_indexed_again():
+    with tempfile.TemporaryDirectory() as data_dir:
+        path = os.path.join(data_dir, 'export.csv')
+        write(path, 'id,value\n1,old\n')
+        reader = CsvReader({'data_dir': data_dir})
+
+        async def lookups():
+            assert await reader.get_info('file:export.csv', '1', 1, [2], ttl=0) == {'Value': 'old'}
+            # Replaced atomically, as a new export would be
+            write(path + '.tmp', 'id,value\n1,new value\n')
+            os.replace(path + '.tmp', path)
+            return await reader.get_info('file:export.csv', '1', 1, [2], ttl=0)
+
+        try:
+            assert asyncio.run(lookups()) == {'Value': 'new value'}
+        finally:
+            reader.close()
+
+
+def test_router_picks_backend_by_scheme():
+    with tempfile.TemporaryDirectory() as data_dir:
+        write(os.path.join(data_dir, 'export.csv'), 'Header 1,Header 2\nK0000001,from file\n')
+        gspread = GspreadReader({}, client=FakeClient(FakeWorksheet(10, 2)))
+        router = DataSourceRouter([gspread, CsvReader({'data_dir': data_dir})])
+
+        async def lookups():
+            assert await router.get_info('https://docs.google.com/spreadsheets/d/x', 'K0000001', 1, [2]) == {
+                'Header 2': 'r1c2'}
+            assert await router.get_info('file:export.csv', 'K0000001', 1, [2]) == {'Header 2': 'from file'}
+            try:
+                await router.get_info('ftp://host/export.csv', 'K0000001', 1, [2])
+                assert False, 'Exception expected'
+            except Exception as e:
+                assert 'Неподдерживаемый' in str(e)
+
+        try:
+            asyncio.run(lookups())
+        finally:
+            router.close()
+
+
+def test_file_rewritten_in_place_does_not_crash_lookups():
+    with tempfile.TemporaryDirectory() as data_dir:
+        path = os.path.join(data_dir, 'export.csv')
+        write(path, 'id,v\n' + ''.join(f'{n},value {n}\n' for n in range(2000)))
+        reader = CsvReader({'data_dir': data_dir})
+
+        async def lookups():
+            assert await reader.get_info('file:export.csv', '1999', 1, [2]) == {'V': 'value 1999'}
+
+            # Truncated in place within the check interval: the old offset is past the new end of file
+            with open(path, 'w') as f:
+                f.write('id,v\n1,y\n')
+            with pytest.raises(Exception, match='изменился'):
+                await reader.get_info('file:export.csv', '1998', 1, [2])
+
+            return await reader.get_info('file:export.csv', '1', 1, [2])
+
+        try:
+            assert asyncio.run(lookups()) == {'V': 'y'}
+        finally:
+            reader.close()
+
+
+def test_file_backend_is_registered_only_with_data_dir(bot):
+    assert 'file' not in bot.data_sources.backends
+    with tempfile.TemporaryDirectory() as data_dir:
+        file_bot = make_bot(FakeWorksheet(1, 1), {'data_dir': data_dir})
+        try:
+            # One memory budget for snapshots of all backends
+            assert file_bot.data_sources.backends['file'].indexes is file_bot.gspread.indexes
+        finally:
+            file_bot.stop()
+
+
+def test_shared_store_keeps_file_indexes_through_the_refresh_loop():
+    with tempfile.TemporaryDirectory() as data_dir:
+        write(os.path.join(data_dir, 'export.csv'), 'id,v\n1,x\n')
+        gspread = GspreadReader({'index_ttl': 60}, client=FakeClient(FakeWorksheet(10, 2)))
+        files = CsvReader({'data_dir': data_dir}, gspread.indexes)
+
+        async def scenario():
+            await gspread.get_info('url', 'K0000001', 1, [2])
+            await files.get_info('file:export.csv', '1', 1, [2])
+            loop = asyncio.ensure_future(gspread.refresh_loop(0.01))
+            await asyncio.sleep(0.05)
+            loop.cancel()
+
+            return len(gspread.indexes)
+
+        try:
+            assert asyncio.run(scenario()) == 2
+        finally:
+            gspread.close()
+            files.close()
@@ -0,0 +1,192 @@
+"""
+Tests for GspreadReader with a local stand-in for the Google client
+"""
+import sys
+import os
+import asyncio
+import threading
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from fakes import FakeClient, FakeWorksheet
+from lib.gspread_reader import GspreadReader
+from lib.quota_scheduler import BACKGROUND
+
+
+def test_readers_do_not_share_worksheets():
+    small = GspreadReader({}, client=FakeClient(FakeWorksheet(10, 3)))
+    large = GspreadReader({}, client=FakeClient(FakeWorksheet(100, 3)))
+
+    async def lookup(reader):
+        return await reader.get_info('url', 'K0000050', 1, [2], 1)
+
+    try:
+        assert asyncio.run(lookup(small)) == {}
+        assert asyncio.run(lookup(large)) == {'Header 2': 'r50c2'}
+    finally:
+        small.close()
+        large.close()
+
+
+def test_find_by_prefix_and_normalized_key():
+    reader = GspreadReader({}, client=FakeClient(FakeWorksheet(100, 3)))
+
+    async def scenario():
+        assert await reader.get_info('url', 'k0000050', 1, [2], 1) == {'Header 2': 'r50c2'}
+        return await reader.find('url', 'K000001', 1, [2, 3], 1, limit=3)
+
+    try:
+        assert asyncio.run(scenario()) == [
+            ('K0000010', {'Header 2': 'r10c2', 'Header 3': 'r10c3'}),
+            ('K0000011', {'Header 2': 'r11c2', 'Header 3': 'r11c3'}),
+            ('K0000012', {'Header 2': 'r12c2', 'Header 3': 'r12c3'}),
+        ]
+    finally:
+        reader.close()
+
+
+def test_composite_key_lookup():
+    reader = GspreadReader({}, client=FakeClient(FakeWorksheet(100, 3)))
+
+    async def scenario():
+        found, missing = await reader.get_info_many('url', [('K0000007', 'r7c2'), ('K0000007', 'r8c2')], '1,2', [3], 1)
+        return found, missing
+
+    try:
+        assert asyncio.run(scenario()) == ({'Header 3': 'r7c3'}, {})
+    finally:
+        reader.close()
+
+
+def test_stale_index_is_served_while_it_refreshes():
+    worksheet = FakeWorksheet(10, 2)
+    reader = GspreadReader({'index_ttl': 60, 'index_max_age': 600}, client=FakeClient(worksheet))
+
+    async def scenario():
+        assert await reader.get_info('url', 'K0000001', 1, [2]) == {'Header 2': 'r1c2'}
+        worksheet.values[1][1] = 'changed'
+        index = next(iter(reader.indexes.values()))
+
+        # Stale: the old snapshot answers at once, the new one loads in the background
+        index.built_at -= 120
+        assert await reader.get_info('url', 'K0000001', 1, [2]) == {'Header 2': 'r1c2'}
+        await asyncio.gather(*reader.loading.values())
+        assert await reader.get_info('url', 'K0000001', 1, [2]) == {'Header 2': 'changed'}
+
+        # Past max age: the caller waits for fresh data
+        worksheet.values[1][1] = 'changed again'
+        next(iter(reader.indexes.values())).built_at -= 1200
+        assert await reader.get_info('url', 'K0000001', 1, [2]) == {'Header 2': 'changed again'}
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        reader.close()
+
+
+class SlowWorksheet(FakeWorksheet):
+    """Worksheet whose downloads take a while, counting them and how many run at once"""
+
+    def __init__(self, rows, columns, delay):
+        super().__init__(rows, columns)
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.running = self.max_running = self.downloads = 0
+
+    def batch_get(self, ranges, major_dimension='ROWS'):
+        with self.lock:
+            self.downloads += 1
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.delay)
+        with self.lock:
+            self.running -= 1
+        return super().batch_get(ranges, major_dimension)
+
+
+def test_lookup_is_not_queued_behind_background_loads():
+    worksheet = SlowWorksheet(10, 2, 0.1)
+    reader = GspreadReader({'gspread_workers': 2, 'google_reads_per_minute': 1200, 'google_burst': 1},
+                           client=FakeClient(worksheet))
+
+    async def scenario():
+        background = [asyncio.ensure_future(reader.get_snapshot(f'url{n}', 1, [2], priority=BACKGROUND))
+                      for n in range(10)]
+        await asyncio.sleep(0.05)
+
+        start = time.monotonic()
+        assert await reader.get_info('interactive', 'K0000001', 1, [2]) == {'Header 2': 'r1c2'}
+        waited = time.monotonic() - start
+        done = sum(task.done() for task in background)
+
+        await asyncio.gather(*background)
+        return waited, done
+
+    try:
+        waited, done = asyncio.run(scenario())
+        # Background loads take over 2 seconds one after another on their single worker, the lookup gets
+        # the other worker and its quota tokens first
+        assert waited < 0.6
+        assert done < 5
+        assert reader.busy_workers == {0: 0, 1: 0}
+    finally:
+        reader.close()
+
+
+def test_concurrent_lookups_share_one_load():
+    worksheet = SlowWorksheet(10, 2, 0.1)
+    reader = GspreadReader({}, client=FakeClient(worksheet))
+
+    async def scenario():
+        results = await asyncio.gather(*(reader.get_info('url', f'K{n:07d}', 1, [2]) for n in range(1, 11)))
+        assert results == [{'Header 2': f'r{n}c2'} for n in range(1, 11)]
+
+    try:
+        asyncio.run(scenario())
+        assert worksheet.downloads == 1
+        assert reader.coalesced_calls == 9
+    finally:
+        reader.close()
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_load():
+    worksheet = SlowWorksheet(10, 2, 0.1)
+    reader = GspreadReader({}, client=FakeClient(worksheet))
+
+    async def scenario():
+        first = asyncio.ensure_future(reader.get_info('url', 'K0000001', 1, [2]))
+        second = asyncio.ensure_future(reader.get_info('url', 'K0000002', 1, [2]))
+        await asyncio.sleep(0.02)
+        first.cancel()
+
+        assert await second == {'Header 2': 'r2c2'}
+        assert first.cancelled()
+        # The load finished for everybody: the next lookup is served from memory
+        assert not reader.loading
+        assert await reader.get_info('url', 'K0000003', 1, [2]) == {'Header 2': 'r3c2'}
+
+    try:
+        asyncio.run(scenario())
+        assert worksheet.downloads == 1
+        assert reader.coalesced_calls == 1
+    finally:
+        reader.close()
+
+
+def test_columns_past_the_sheet_width_are_empty():
+    worksheet = FakeWorksheet(10, 3)
+    reader = GspreadReader({'index_ttl': 60}, client=FakeClient(worksheet))
+
+    async def scenario():
+        assert await reader.get_info('url', 'K0000001', 1, [2, 28]) == {'Header 2': 'r1c2', 'Column 28': ''}
+
+        # Column added after the worksheet was opened
+        for row, values in enumerate(worksheet.values):
+            values.extend([''] * 24 + ['Late' if row == 0 else f'r{row}c28'])
+        reader.indexes.clear()
+        return await reader.get_info('url', 'K0000001', 1, [2, 28])
+
+    try:
+        assert asyncio.run(scenario()) == {'Header 2': 'r1c2', 'Late': 'r1c28'}
+    finally:
+        reader.close()
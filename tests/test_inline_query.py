@@ -0,0 +1,64 @@
+"""
+Tests for inline queries answered from the worksheet index
+"""
+import sys
+import os
+import asyncio
+import types
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+import pytest
+
+from fakes import make_update, message_text
+
+
+class InlineQuery:
+    def __init__(self, query_id, query):
+        self.id = query_id
+        self.query = query
+        self.from_user = types.SimpleNamespace(id=1)
+        self.answers = []
+
+    async def answer(self, results, **kwargs):
+        self.answers.append((results, kwargs))
+
+
+@pytest.fixture
+def bot_config():
+    return {'inline_debounce': 0.05}
+
+
+def test_only_the_last_query_typed_is_answered(bot):
+    partial, complete = InlineQuery('1', 'K00000'), InlineQuery('2', 'k000002')
+
+    async def scenario():
+        update, context = make_update('/cfg_set_source default url 1 1 2,3')
+        await bot.common_handler(update, context)
+
+        await asyncio.gather(bot.inline_query(types.SimpleNamespace(inline_query=partial), None),
+                             bot.inline_query(types.SimpleNamespace(inline_query=complete), None))
+
+    asyncio.run(scenario())
+
+    assert partial.answers == []
+    results, options = complete.answers[0]
+    assert [result.title for result in results] == ['K0000020'] + [f'K00000{n}' for n in range(21, 30)]
+    assert options['is_personal'] is True
+    assert 'r20c2' in results[0].input_message_content.message_text
+
+
+def test_answers_are_escaped(bot, worksheet):
+    worksheet.values[20][1] = 'a<b & c'
+    worksheet.values[21][1] = '<' * 5000
+    query = InlineQuery('1', 'K000002')
+
+    async def scenario():
+        update, context = make_update('/cfg_set_source default url 1 1 2,3')
+        await bot.common_handler(update, context)
+        await bot.inline_query(types.SimpleNamespace(inline_query=query), None)
+
+    asyncio.run(scenario())
+
+    results, _ = query.answers[0]
+    assert 'Header 2 : a<b & c' in message_text(results[0].input_message_content.message_text)
+    assert '<' * 400 in message_text(results[1].input_message_content.message_text)
@@ -0,0 +1,70 @@
+"""
+Tests for the in-process LRU/TTL cache
+"""
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from prometheus_client import REGISTRY
+
+from lib.local_cache import LocalCache
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LocalCache(max_size=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert len(cache) == 2
+
+
+def test_expired_entry_is_a_miss():
+    cache = LocalCache(ttl=0)
+    cache.set('a', 1)
+
+    assert cache.get('a', 'missing') == 'missing'
+    assert cache.misses == 1
+    assert len(cache) == 0
+
+
+def test_falsy_values_are_cached():
+    cache = LocalCache()
+    cache.set('empty', {})
+
+    assert cache.get('empty', 'missing') == {}
+    assert cache.hits == 1
+
+
+def test_delete_where_and_disabled_cache():
+    cache = LocalCache()
+    cache.set(('sources', 'a'), 1)
+    cache.set(('sources', 'b'), 2)
+    cache.set(('current_source:1', None), 3)
+    cache.delete_where(lambda key: key[0] == 'sources')
+
+    assert len(cache) == 1
+
+    disabled = LocalCache(max_size=0)
+    disabled.set('a', 1)
+    assert disabled.get('a') is None
+
+
+def test_named_cache_reports_hits_and_misses_to_metrics():
+    def requests(result):
+        return REGISTRY.get_sample_value('bot_cache_requests_total', {'cache': 'test_cache', 'result': result}) or 0
+
+    hits_before, misses_before = requests('hit'), requests('miss')
+
+    cache = LocalCache(name='test_cache')
+    cache.set('a', 1)
+    cache.get('a')
+    cache.get('b')
+
+    assert requests('hit') == hits_before + 1
+    assert requests('miss') == misses_before + 1
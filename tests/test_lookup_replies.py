@@ -0,0 +1,74 @@
+"""
+Tests for /i replies: batch and newline separated keys, HTML escaping and pagination
+"""
+import sys
+import os
+import asyncio
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+import pytest
+
+from fakes import FakeWorksheet, make_update, message_text
+
+
+@pytest.fixture
+def worksheet():
+    worksheet = FakeWorksheet(10, 3)
+    worksheet.values[0][1] = '<Header & 2>'
+    worksheet.values[1][1] = 'a<b & c>d'
+    return worksheet
+
+
+async def ask(bot, text):
+    update, context = make_update('/cfg_set_source default url 1 1 2,3')
+    await bot.common_handler(update, context)
+    update, context = make_update(text)
+    await bot.common_handler(update, context)
+
+    return [message_text(message) for message in update.effective_chat.messages]
+
+
+def test_keys_headers_and_values_are_escaped(bot):
+    texts = asyncio.run(ask(bot, '/i K0000001 a<b'))
+
+    assert len(texts) == 1
+    assert 'Результаты для 2 ключей' in texts[0]
+    # Headers are shown capitalized
+    assert '<header & 2> : a<b & c>d' in texts[0]
+    assert 'Ключ a<b: значение не найдено' in texts[0]
+
+    texts = asyncio.run(ask(bot, '/i K0000001'))
+    assert texts[0].startswith('Результат для ключа K0000001')
+
+
+def test_keys_on_separate_lines(bot):
+    texts = asyncio.run(ask(bot, '/i K0000002\nK0000003\nK0000002'))
+
+    assert 'Результаты для 2 ключей (лист 1), найдено: 2' in texts[0]
+    assert 'r2c3' in texts[0] and 'r3c3' in texts[0]
+
+
+def test_long_replies_are_split_into_messages(bot, worksheet):
+    for row in range(1, 11):
+        worksheet.values[row][2] = f'<{row}>' + 'x' * 3000
+    worksheet.values[5][2] = 'line\n' + '&' * 9000
+
+    texts = asyncio.run(ask(bot, '/i ' + ' '.join(f'K{row:07d}' for row in range(1, 11))))
+    assert len(texts) > 5
+    text = ''.join(texts)
+    for row in range(1, 11):
+        assert text.count(f'<{row}>') == (0 if row == 5 else 1)
+    assert text.count('x') == 3000 * 9
+    # Every row has one in its header, the first one in its value too
+    assert text.count('&') == 9000 + 10 + 1
+
+    # A single row longer than a message is split too
+    texts = asyncio.run(ask(bot, '/i K0000005'))
+    assert len(texts) > 1
+    assert ''.join(texts).count('&') == 9000 + 1
+    assert texts[1].startswith('&' * 400 + '\n')
+
+
+def test_paginate_keeps_blocks_together(bot):
+    assert bot.paginate(['a\n', 'bb\n', 'c\n'], limit=5) == ['a\nbb\n', 'c\n']
+    assert bot.paginate(['a\nbb\ncc\n'], limit=5) == ['a\nbb\n', 'cc\n']
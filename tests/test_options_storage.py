@@ -0,0 +1,100 @@
+"""
+Tests for dict options stored as Redis hashes and the startup migration of legacy JSON documents, on fakeredis
+"""
+import asyncio
+import json
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+import fakeredis
+
+from fakes import make_update
+from lib.async_options import AsyncOptions
+from lib.options import Options
+
+SETUP = {
+    'current_source': {'type': 'str', 'is_global_entity': False, 'default': 'default'},
+    'sources': {'type': 'dict', 'is_global_entity': True},
+}
+
+SOURCE = json.dumps({'url': 'url', 'sheet': '1', 'seek': '1', 'columns': '2,3'})
+
+
+def test_migration_converts_json_document_to_hash():
+    client = fakeredis.FakeRedis(decode_responses=True)
+    client.set('sources', json.dumps({'default': SOURCE, 'nested': {'sheet': 2}, 'count': 5, 'gone': None}))
+
+    options = Options(SETUP, redis_client=client)
+
+    assert client.type('sources') == 'hash'
+    # null fields are left out instead of being stored as "userdata: ..." strings
+    assert client.hgetall('sources') == {'default': SOURCE, 'nested': '{"sheet":2}', 'count': '5'}
+    assert options.get_option(1, 'sources', 'default') == SOURCE
+    assert options.get_option(1, 'sources', 'gone') == {}
+
+    # Keys already converted are skipped on the next startup
+    assert options.migrate_dict_options() == 0
+    assert client.hgetall('sources')['default'] == SOURCE
+
+
+def test_migration_keeps_values_that_are_not_json_objects():
+    client = fakeredis.FakeRedis(decode_responses=True)
+
+    for value in ('{not json', '[1, 2]', '"text"'):
+        client.set('sources', value)
+        options = Options(SETUP, redis_client=client)
+
+        assert options.migrate_dict_options() == 0
+        assert client.get('sources') == value
+
+
+def test_async_migration_does_not_abort_on_malformed_documents():
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    options = AsyncOptions(SETUP, redis_client=client)
+
+    async def scenario():
+        await client.set('sources', '{"default": ')
+        assert await options.migrate_dict_options() == 0
+        assert await client.get('sources') == '{"default": '
+
+        await client.set('sources', json.dumps({'default': SOURCE, 'gone': None}))
+        assert await options.migrate_dict_options() == 1
+        assert await client.hgetall('sources') == {'default': SOURCE}
+
+    asyncio.run(scenario())
+
+
+def test_dict_option_fields_are_hash_fields():
+    client = fakeredis.FakeRedis(decode_responses=True)
+    options = Options(SETUP, redis_client=client)
+
+    options.set_option(1, 'sources', SOURCE, 'default')
+    options.set_option(1, 'sources', 'other', 'second')
+    assert client.type('sources') == 'hash'
+    assert client.hget('sources', 'second') == 'other'
+    assert options.get_option(1, 'sources', 'default') == SOURCE
+    assert options.get_option_items(1, 'sources') == {'default': SOURCE, 'second': 'other'}
+
+    assert options.delete_option(1, 'sources', 'second') == 1
+    assert options.delete_option(1, 'sources', 'second') == 0
+    assert client.hgetall('sources') == {'default': SOURCE}
+    assert options.get_option(1, 'sources', 'second') == {}
+
+
+def test_cfg_del_source_removes_the_hash_field(bot):
+    async def scenario():
+        for name in ('default', 'second'):
+            update, context = make_update(f'/cfg_set_source {name} url 1 1 2,3')
+            await bot.common_handler(update, context)
+
+        update, context = make_update('/cfg_del_source second')
+        await bot.common_handler(update, context)
+        assert update.effective_chat.messages == ['Источник "second" удалён']
+        assert await bot.options.redis.client.hkeys('sources') == ['default']
+
+        update, context = make_update('/cfg_del_source second')
+        await bot.common_handler(update, context)
+        assert update.effective_chat.messages == ['Источник не найден: second']
+
+    asyncio.run(scenario())
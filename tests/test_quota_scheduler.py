@@ -0,0 +1,104 @@
+"""
+Tests for the Google Sheets quota scheduler: token bucket, priorities and retries
+"""
+import os
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from gspread.exceptions import APIError
+from prometheus_client import REGISTRY
+
+from lib.quota_scheduler import BACKGROUND, INTERACTIVE, QuotaScheduler
+
+
+def api_error(code):
+    response = types.SimpleNamespace(json=lambda: {'error': {'code': code, 'message': 'error', 'status': ''}},
+                                     text='')
+    return APIError(response)
+
+
+def test_burst_then_rate():
+    quota = QuotaScheduler(requests_per_minute=600, burst=2)
+
+    assert quota.acquire() < 0.01
+    assert quota.acquire() < 0.01
+    # Bucket is empty, the next token comes in 0.1 second
+    assert 0.05 < quota.acquire() < 0.5
+
+
+def test_interactive_goes_before_background():
+    quota = QuotaScheduler(requests_per_minute=600, burst=1)
+    quota.acquire()
+    order = []
+
+    def worker(priority, name):
+        quota.acquire(priority)
+        order.append(name)
+
+    background = threading.Thread(target=worker, args=(BACKGROUND, 'background'))
+    background.start()
+    time.sleep(0.02)
+    interactive = threading.Thread(target=worker, args=(INTERACTIVE, 'interactive'))
+    interactive.start()
+    background.join(2)
+    interactive.join(2)
+
+    assert order == ['interactive', 'background']
+
+
+def test_retries_rate_limited_calls():
+    quota = QuotaScheduler(requests_per_minute=0, base_delay=0)
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise api_error(429 if len(calls) == 1 else 503)
+        return 'ok'
+
+    assert quota.call(INTERACTIVE, flaky) == 'ok'
+    assert len(calls) == 3
+
+
+def test_latency_histogram_times_only_the_call():
+    quota = QuotaScheduler(requests_per_minute=600, burst=1)
+    quota.acquire()
+    labels = {'operation': 'test_quota_wait'}
+
+    # Waits 0.1 second for a token, the call itself returns at once
+    assert quota.call(INTERACTIVE, lambda: 'ok', operation='test_quota_wait') == 'ok'
+    assert REGISTRY.get_sample_value('bot_google_request_duration_seconds_count', labels) == 1
+    assert REGISTRY.get_sample_value('bot_google_request_duration_seconds_sum', labels) < 0.05
+
+
+def test_gives_up_after_max_retries():
+    quota = QuotaScheduler(requests_per_minute=0, max_retries=2, base_delay=0)
+    calls = []
+
+    def rate_limited():
+        calls.append(1)
+        raise api_error(429)
+
+    # Reported to the user as a quota error, not as the raw API error
+    with pytest.raises(Exception, match='квота') as error:
+        quota.call(BACKGROUND, rate_limited)
+    assert not isinstance(error.value, APIError)
+    assert len(calls) == 3
+
+    # Client errors are not retried
+    calls.clear()
+
+    def not_found():
+        calls.append(1)
+        raise api_error(404)
+
+    with pytest.raises(APIError) as error:
+        quota.call(INTERACTIVE, not_found)
+    assert error.value.code == 404
+    assert len(calls) == 1
@@ -0,0 +1,36 @@
+"""
+Tests for the cache of rendered /i rows
+"""
+import sys
+import os
+import asyncio
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+import pytest
+
+from fakes import FakeWorksheet, make_update
+
+
+@pytest.fixture
+def worksheet():
+    return FakeWorksheet(10, 3)
+
+
+def test_rendered_rows_are_reused_until_the_snapshot_changes(bot, worksheet):
+
+    async def scenario():
+        update, context = make_update('/cfg_set_source default url 1 1 2,3')
+        await bot.common_handler(update, context)
+
+        first = await bot.render_rows('url', ['K0000001', 'missing'], ['1'], ['2', '3'], 1, None)
+        hits = bot.replies.hits
+        assert await bot.render_rows('url', ['K0000001', 'missing'], ['1'], ['2', '3'], 1, None) == first
+        assert bot.replies.hits == hits + 2
+        assert first[1] == ''
+
+        # New snapshot, new version: the row is rendered again from fresh data
+        worksheet.values[1][1] = 'changed'
+        bot.gspread.indexes.clear()
+        return await bot.render_rows('url', ['K0000001'], ['1'], ['2', '3'], 1, None)
+
+    assert 'changed' in asyncio.run(scenario())[0]
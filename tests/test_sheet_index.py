@@ -0,0 +1,74 @@
+"""
+Tests for the worksheet lookup index
+"""
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from lib.sheet_index import SheetIndex
+
+
+def test_lookup_returns_first_matching_row():
+    index = SheetIndex({
+        1: ['id', '1', '2', '1'],
+        2: ['name', 'first', 'second', 'duplicate'],
+    }, 1)
+
+    assert index.lookup('1') == 0
+    assert index.lookup(2) == 1
+    assert index.lookup('3') is None
+    assert index.get_value(index.lookup('2'), 2) == 'second'
+    assert len(index) == 2
+
+
+def test_trimmed_and_missing_columns():
+    index = SheetIndex({1: ['name', 'x', 'y'], 2: ['id', '6', '7'], 3: []}, 2)
+
+    assert index.get_value(index.lookup('7'), 1) == 'y'
+    assert index.get_value(index.lookup('7'), 3) == ''
+    assert index.get_header(3) == ''
+    assert index.get_header(4) == ''
+
+
+def test_empty_worksheet():
+    index = SheetIndex({}, 1)
+
+    assert index.headers == {}
+    assert index.lookup('1') is None
+
+
+def test_expiration():
+    index = SheetIndex({1: ['id']}, 1)
+
+    assert index.is_expired(0)
+    assert not index.is_expired(60)
+
+
+def test_normalized_and_prefix_search():
+    index = SheetIndex({1: ['id', 'AB-100', '00042', 'ab-105', 'Ab 1 99', 'x']}, 1)
+
+    assert SheetIndex.normalize(' 007 Ab ') == '7ab'
+    assert SheetIndex.normalize('000') == '0'
+    assert index.lookup('ab-100') is None
+    assert index.lookup_normalized('ab-100') == 0
+    assert index.lookup_normalized('42') == 1
+    assert index.search('ab-10') == [0, 2]
+    assert index.search('AB', limit=2) == [0, 2]
+    assert index.search('AB') == [0, 2, 3]
+    assert index.search('') == []
+    assert index.get_key(2) == 'ab-105'
+
+
+def test_composite_key():
+    index = SheetIndex({
+        1: ['warehouse', 'A', 'A', 'B'],
+        2: ['sku', '123', '456', '123'],
+        3: ['qty', '1', '2', '3'],
+    }, (1, 2))
+
+    assert index.get_value(index.lookup(('B', '123')), 3) == '3'
+    assert index.lookup(('A', 123)) == 0
+    assert index.lookup(('C', '123')) is None
+    assert index.lookup_normalized(('a', '0456')) == 1
+    assert index.search(('a',)) == [0, 1]
+    assert index.get_key(2) == ('B', '123')
@@ -0,0 +1,178 @@
+"""
+Tests for the shared worksheet snapshot cache
+"""
+import asyncio
+import sys
+import os
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from fakes import FakeClient, FakeWorksheet
+from lib import snapshot_cache
+from lib.gspread_reader import GspreadReader
+from lib.snapshot_cache import SnapshotCache
+
+
+class MemoryRedis:
+    """Stand-in for lib.redis.Redis keeping values in a dict"""
+    def __init__(self):
+        self.data = {}
+
+    def get_bytes(self, key):
+        return self.data.get(key)
+
+    def set_bytes(self, key, value, expire=None):
+        self.data[key] = value
+        return True
+
+    def acquire_lock(self, key, ttl):
+        if key in self.data:
+            return None
+        self.data[key] = 'token'
+        return 'token'
+
+    def release_lock(self, key, token):
+        return self.data.pop(key, None) == token
+
+    def close(self):
+        pass
+
+
+COLUMNS = {1: ['id', '1', '2'], 3: ['name', 'first', 'второй']}
+
+
+def test_fetch_downloads_once_and_shares_snapshot():
+    redis = MemoryRedis()
+    downloads = []
+
+    def download():
+        downloads.append(1)
+        return COLUMNS
+
+    first = SnapshotCache(redis, ttl=60)
+    values, age = first.fetch('https://example.com/sheet', 1, [1, 3], download)
+    assert values == COLUMNS
+    assert age == 0.0
+
+    # Another replica gets the snapshot from Redis
+    second = SnapshotCache(redis, ttl=60)
+    values, age = second.fetch('https://example.com/sheet', 1, [1, 3], download)
+    assert values == COLUMNS
+    assert age < 60
+    assert len(downloads) == 1
+    assert not any(key.endswith(':lock') for key in redis.data)
+
+
+def test_stale_snapshot_is_served_while_locked_by_another_replica():
+    redis = MemoryRedis()
+    cache = SnapshotCache(redis, ttl=0)
+    cache.save('u', 1, [1, 3], COLUMNS)
+    redis.acquire_lock(cache.get_key('u', 1, [1, 3]) + ':lock', 60)
+
+    values, age = cache.fetch('u', 1, [1, 3], lambda: {})
+    assert values == COLUMNS
+
+
+def test_foreign_payload_is_ignored():
+    redis = MemoryRedis()
+    cache = SnapshotCache(redis)
+    redis.set_bytes(cache.get_key('u', 1, [1]), b'not compressed')
+
+    assert cache.load('u', 1, [1]) is None
+
+
+class CountingWorksheet(FakeWorksheet):
+    def __init__(self, rows, columns):
+        super().__init__(rows, columns)
+        self.downloads = 0
+
+    def batch_get(self, ranges, major_dimension='ROWS'):
+        self.downloads += 1
+        return super().batch_get(ranges, major_dimension)
+
+
+def save_aged(cache, location, columns, values, age, monkeypatch):
+    """Store a snapshot as if it was saved age seconds ago"""
+    saved_at = time.time() - age
+    with monkeypatch.context() as patch:
+        patch.setattr(snapshot_cache.time, 'time', lambda: saved_at)
+        cache.save(location, 1, columns, values)
+
+
+def test_source_ttl_decides_freshness_of_shared_snapshot(monkeypatch):
+    redis = MemoryRedis()
+    cache = SnapshotCache(redis, ttl=300)
+    worksheet = CountingWorksheet(10, 2)
+    save_aged(cache, 'url', [1, 2], {1: ['Header 1', 'K0000001'], 2: ['Header 2', 'old']}, 60, monkeypatch)
+    reader = GspreadReader({'index_ttl': 300}, snapshot_cache=cache, client=FakeClient(worksheet))
+
+    async def scenario():
+        # Fresh by INDEX_TTL, but older than the source's 10 seconds: downloaded again
+        assert await reader.get_info('url', 'K0000001', 1, [2], ttl=10) == {'Header 2': 'r1c2'}
+        for _ in range(5):
+            assert await reader.get_info('url', 'K0000001', 1, [2], ttl=10) == {'Header 2': 'r1c2'}
+            assert not reader.loading
+
+    try:
+        asyncio.run(scenario())
+        assert worksheet.downloads == 1
+    finally:
+        reader.close()
+
+
+def test_stale_shared_snapshot_does_not_start_another_refresh(monkeypatch):
+    redis = MemoryRedis()
+    cache = SnapshotCache(redis, ttl=300)
+    worksheet = CountingWorksheet(10, 2)
+    save_aged(cache, 'url', [1, 2], {1: ['Header 1', 'K0000001'], 2: ['Header 2', 'old']}, 60, monkeypatch)
+    # Another replica is downloading the sheet
+    redis.acquire_lock(cache.get_key('url', 1, [1, 2]) + ':lock', 60)
+    reader = GspreadReader({'index_ttl': 10}, snapshot_cache=cache, client=FakeClient(worksheet))
+
+    async def scenario():
+        assert await reader.get_info('url', 'K0000001', 1, [2]) == {'Header 2': 'old'}
+        assert not reader.loading
+
+    try:
+        asyncio.run(scenario())
+        assert worksheet.downloads == 0
+    finally:
+        reader.close()
+
+
+class FailingRedis(MemoryRedis):
+    """Redis that fails the given commands, like one out of memory or unreachable"""
+    def __init__(self, *failing):
+        super().__init__()
+        self.failing = failing
+
+    def __getattribute__(self, name):
+        if name in object.__getattribute__(self, 'failing'):
+            def fail(*args, **kwargs):
+                raise Exception('Failed to set value in Redis: OOM command not allowed when used memory > maxmemory')
+            return fail
+        return object.__getattribute__(self, name)
+
+
+def test_redis_errors_fall_back_to_download():
+    for failing in [('set_bytes',), ('get_bytes',), ('acquire_lock',), ('release_lock',),
+                    ('get_bytes', 'set_bytes', 'acquire_lock', 'release_lock')]:
+        downloads = []
+
+        def download():
+            downloads.append(1)
+            return COLUMNS
+
+        cache = SnapshotCache(FailingRedis(*failing), ttl=60)
+        assert cache.fetch('u', 1, [1, 3], download) == (COLUMNS, 0.0)
+        assert len(downloads) == 1
+
+
+def test_lookup_succeeds_when_redis_is_full():
+    cache = SnapshotCache(FailingRedis('set_bytes'), ttl=60)
+    reader = GspreadReader({}, snapshot_cache=cache, client=FakeClient(FakeWorksheet(10, 2)))
+
+    try:
+        assert asyncio.run(reader.get_info('url', 'K0000001', 1, [2])) == {'Header 2': 'r1c2'}
+    finally:
+        reader.close()
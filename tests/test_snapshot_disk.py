@@ -0,0 +1,85 @@
+"""
+Tests for worksheet snapshots kept on disk across restarts
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import types
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from fakes import FakeClient, FakeWorksheet
+from lib.gspread_reader import GspreadReader
+from lib.snapshot_disk import DiskSnapshotStore
+
+
+class TrackedWorksheet(FakeWorksheet):
+    """Worksheet that counts downloads and reports a modification time like the Drive API"""
+
+    def __init__(self, rows, columns):
+        super().__init__(rows, columns)
+        self.downloads = 0
+        self.spreadsheet = types.SimpleNamespace(get_lastUpdateTime=lambda: self.modified)
+        self.modified = '2026-01-01T00:00:00.000Z'
+
+    def batch_get(self, ranges, major_dimension='ROWS'):
+        self.downloads += 1
+        return super().batch_get(ranges, major_dimension)
+
+
+async def settle(reader):
+    """Wait for background loads of the reader"""
+    while reader.loading:
+        await asyncio.gather(*reader.loading.values(), return_exceptions=True)
+
+
+def test_store_round_trip():
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        path = os.path.join(snapshot_dir, 'nested', 'snapshots.sqlite3')
+        store = DiskSnapshotStore(path)
+        store.save('key', {1: ['Id', 'K1'], 3: ['Name', 'Ann']}, 'marker', age=5)
+        store.close()
+
+        store = DiskSnapshotStore(path)
+        values, marker, age = store.load('key')
+        assert values == {1: ['Id', 'K1'], 3: ['Name', 'Ann']}
+        assert marker == 'marker'
+        assert 5 <= age < 10
+        assert store.load('missing') is None
+        store.close()
+
+
+def test_restart_serves_from_disk_and_revalidates():
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        path = os.path.join(snapshot_dir, 'snapshots.sqlite3')
+        worksheet = TrackedWorksheet(20, 3)
+
+        first = GspreadReader({}, client=FakeClient(worksheet), disk_store=DiskSnapshotStore(path))
+        try:
+            assert asyncio.run(first.get_info('url', 'K0000020', 1, [2])) == {'Header 2': 'r20c2'}
+        finally:
+            first.close()
+        assert worksheet.downloads == 1
+
+        # Restarted bot: nothing in memory, the spreadsheet has not changed
+        second = GspreadReader({}, client=FakeClient(worksheet), disk_store=DiskSnapshotStore(path))
+
+        async def lookups():
+            assert await second.get_info('url', 'K0000020', 1, [2], ttl=0) == {'Header 2': 'r20c2'}
+            version = (await second.get_snapshot('url', 1, [2])).version
+            await settle(second)
+            assert worksheet.downloads == 1
+            assert (await second.get_snapshot('url', 1, [2])).version == version
+
+            # Changed spreadsheet is downloaded in the background while the saved snapshot is served
+            worksheet.values[20][1] = 'changed'
+            worksheet.modified = '2026-01-02T00:00:00.000Z'
+            assert await second.get_info('url', 'K0000020', 1, [2], ttl=0) == {'Header 2': 'r20c2'}
+            await settle(second)
+            return await second.get_info('url', 'K0000020', 1, [2])
+
+        try:
+            assert asyncio.run(lookups()) == {'Header 2': 'changed'}
+            assert worksheet.downloads == 2
+        finally:
+            second.close()
@@ -0,0 +1,42 @@
+"""
+Tests for the memory bounded worksheet snapshot store
+"""
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from lib.sheet_index import SheetIndex
+from lib.snapshot_store import SnapshotStore
+
+
+def make_index(rows):
+    return SheetIndex({1: ['id'] + [f'key{row}' for row in range(rows)], 2: ['status'] + ['ok'] * rows}, 1)
+
+
+def test_repeated_values_are_stored_once():
+    index = make_index(1000)
+    distinct, codes = index.columns[2]
+
+    assert distinct == ['ok']
+    assert codes.typecode == 'B'
+    assert index.get_value(999, 2) == 'ok'
+    assert index.get_value(1000, 2) == ''
+
+
+def test_least_recently_used_snapshot_is_evicted_over_budget():
+    first, second, third = make_index(100), make_index(100), make_index(100)
+    store = SnapshotStore(max_bytes=first.memory_size() * 2.5)
+    store.set('first', first)
+    store.set('second', second)
+    assert store.get('first') is first
+
+    assert store.set('third', third) == ['second']
+    assert 'first' in store and 'third' in store
+    assert store.memory_size() <= store.max_bytes
+
+
+def test_snapshot_over_budget_alone_is_kept():
+    store = SnapshotStore(max_bytes=1)
+
+    assert store.set('only', make_index(10)) == []
+    assert len(store) == 1
@@ -0,0 +1,78 @@
+"""
+Tests for resolving the user's current source: Options.resolve_option and the decoded config cache of TgBot
+"""
+import asyncio
+import json
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+import fakeredis
+
+from fakes import make_update
+from lib.options import Options
+
+SETUP = {
+    'current_source': {'type': 'str', 'is_global_entity': False, 'default': 'default'},
+    'sources': {'type': 'dict', 'is_global_entity': True},
+}
+
+
+async def send(bot, text, user_id=1):
+    update, context = make_update(text, user_id)
+    await bot.common_handler(update, context)
+
+    return update.effective_chat.messages
+
+
+def test_resolve_option_falls_back_to_the_default_key():
+    client = fakeredis.FakeRedis(decode_responses=True)
+    options = Options(SETUP, redis_client=client)
+
+    assert options.resolve_option(1, 'current_source', 'sources') == ('default', {})
+
+    client.hset('sources', 'default', 'first')
+    client.hset('sources', 'other', 'second')
+    options.invalidate()
+    assert options.resolve_option(1, 'current_source', 'sources') == ('default', 'first')
+
+    options.set_option(1, 'current_source', 'other')
+    assert options.resolve_option(1, 'current_source', 'sources') == ('other', 'second')
+    # Users without current_source still get the default one
+    assert options.resolve_option(2, 'current_source', 'sources') == ('default', 'first')
+
+
+def test_current_source_is_resolved_without_current_source_set(bot):
+    async def scenario():
+        assert await bot.get_current_source(1) == ('default', {})
+
+        await send(bot, '/cfg_set_source default url 1 1 2,3')
+        assert await bot.get_current_source(1) == ('default', {'url': 'url', 'sheet': '1', 'seek': '1', 'columns': '2,3'})
+
+        await send(bot, '/cfg_set_source other url 2 1 3')
+        await send(bot, '/set_source other')
+        assert await bot.get_current_source(1) == ('other', {'url': 'url', 'sheet': '2', 'seek': '1', 'columns': '3'})
+        assert await bot.get_current_source(2) == ('default', {'url': 'url', 'sheet': '1', 'seek': '1', 'columns': '2,3'})
+
+    asyncio.run(scenario())
+
+
+def test_decoded_config_is_dropped_after_changes(bot):
+    async def scenario():
+        await send(bot, '/cfg_set_source default url 1 1 2,3')
+        first = (await bot.get_current_source(1))[1]
+        # Decoded once, the same object is served from the cache
+        assert (await bot.get_current_source(1))[1] is first
+
+        await send(bot, '/cfg_set_source default url 1 1 3')
+        assert (await bot.get_current_source(1))[1]['columns'] == '3'
+
+        # Changed by another replica: the stale config is served until the invalidation arrives
+        changed = json.dumps({'url': 'url', 'sheet': '1', 'seek': '1', 'columns': '2'})
+        await bot.options.redis.client.hset('sources', 'default', changed)
+        assert (await bot.get_current_source(1))[1]['columns'] == '3'
+
+        bot.options.invalidate('sources')
+        assert (await bot.get_current_source(1))[1]['columns'] == '2'
+
+    asyncio.run(scenario())
@@ -0,0 +1,57 @@
+"""
+Tests for the fair per-chat update processor
+"""
+import sys
+import os
+import asyncio
+import types
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+from lib.update_processor import FairUpdateProcessor
+
+
+def make_update(chat_id):
+    return types.SimpleNamespace(effective_chat=types.SimpleNamespace(id=chat_id), effective_user=None)
+
+
+async def run_updates(processor, chat_ids, delay=0.01):
+    log = []
+    running = set()
+    peak = [0]
+
+    async def handle(chat_id, number):
+        running.add((chat_id, number))
+        peak[0] = max(peak[0], len(running))
+        log.append(('start', chat_id, number))
+        await asyncio.sleep(delay)
+        running.discard((chat_id, number))
+
+    tasks = []
+    for number, chat_id in enumerate(chat_ids):
+        tasks.append(asyncio.create_task(processor.process_update(make_update(chat_id), handle(chat_id, number))))
+        # Let the update reach the scheduler in arrival order
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+
+    return log, peak[0]
+
+
+def test_updates_of_one_chat_keep_order_and_do_not_overlap():
+    log, peak = asyncio.run(run_updates(FairUpdateProcessor(4), [1, 1, 1, 1]))
+
+    assert [number for _, _, number in log] == [0, 1, 2, 3]
+    assert peak == 1
+
+
+def test_different_chats_run_concurrently_up_to_the_limit():
+    log, peak = asyncio.run(run_updates(FairUpdateProcessor(2), [1, 2, 3, 4]))
+
+    assert peak == 2
+    assert len(log) == 4
+
+
+def test_busy_chat_does_not_starve_others():
+    # Chat 1 floods first, chat 2 sends one update later: it must run right after the first update of chat 1
+    log, _ = asyncio.run(run_updates(FairUpdateProcessor(1), [1, 1, 1, 1, 2]))
+
+    assert [chat_id for _, chat_id, _ in log] == [1, 2, 1, 1, 1]
@@ -0,0 +1,34 @@
+"""
+Tests for preloading configured sources at startup
+"""
+import sys
+import os
+import asyncio
+import json
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+import pytest
+
+from fakes import FakeWorksheet
+
+
+@pytest.fixture
+def worksheet():
+    return FakeWorksheet(20, 3)
+
+
+def test_warm_up_loads_each_worksheet_once_and_reports_readiness(bot):
+    source = {'url': 'url', 'sheet': '1', 'seek': '1', 'columns': '2,3'}
+
+    async def scenario():
+        await bot.options.set_option(1, 'sources', json.dumps(source), 'first')
+        await bot.options.set_option(2, 'sources', json.dumps(source), 'same_worksheet')
+        await bot.options.set_option(3, 'sources', '{"url": "url"}', 'broken')
+
+        await bot.warm_up()
+        assert bot.ready.is_set()
+        assert len(bot.gspread.indexes) == 1
+
+        return await bot.gspread.get_info('url', 'K0000020', 1, [2, 3], 1)
+
+    assert asyncio.run(scenario()) == {'Header 2': 'r20c2', 'Header 3': 'r20c3'}
@@ -0,0 +1,62 @@
+"""
+Tests for the webhook server: posts fake updates with a local HTTP client
+"""
+import sys
+import os
+import asyncio
+import socket
+import types
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+import httpx
+
+from lib.webhook_server import WebhookServer, SECRET_TOKEN_HEADER
+
+UPDATE = {
+    'update_id': 1,
+    'message': {
+        'message_id': 1,
+        'date': 0,
+        'chat': {'id': 10, 'type': 'private'},
+        'from': {'id': 20, 'is_bot': False, 'first_name': 'Test'},
+        'text': '/i 123',
+    },
+}
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def post_updates(port, queue):
+    application = types.SimpleNamespace(bot=None, update_queue=queue)
+    server = WebhookServer(application, 'hook', secret_token='secret')
+    server.start('127.0.0.1', port)
+    url = f'http://127.0.0.1:{port}'
+    try:
+        async with httpx.AsyncClient() as client:
+            return [
+                (await client.post(url + '/hook', json=UPDATE, headers={SECRET_TOKEN_HEADER: 'secret'})).status_code,
+                (await client.post(url + '/hook', json=UPDATE, headers={SECRET_TOKEN_HEADER: 'wrong'})).status_code,
+                (await client.post(url + '/hook', json=UPDATE)).status_code,
+                (await client.post(url + '/hook', content=b'{', headers={SECRET_TOKEN_HEADER: 'secret'})).status_code,
+                (await client.get(url + '/healthz')).status_code,
+            ]
+    finally:
+        await server.stop()
+
+
+def test_updates_are_queued_only_with_valid_secret():
+    async def run():
+        queue = asyncio.Queue()
+        statuses = await post_updates(get_free_port(), queue)
+        return statuses, [queue.get_nowait() for _ in range(queue.qsize())]
+
+    statuses, updates = asyncio.run(run())
+
+    assert statuses == [200, 403, 403, 400, 200]
+    assert len(updates) == 1
+    assert updates[0].message.text == '/i 123'
+    assert updates[0].effective_chat.id == 10